@@ -2,43 +2,418 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import os
+import re
+import unicodedata
+import io
+import csv
 import json
+import base64
+import click
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
+import babel.dates
+from flask import Flask, request, Response, flash, redirect, url_for, jsonify, abort, Markup, stream_with_context, get_flashed_messages, g, has_request_context, session, make_response
+from flask import render_template as flask_render_template
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_, and_, func, asc, desc
-from sqlalchemy.orm import load_only
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy import or_, and_, func, asc, desc, tuple_, literal_column, cast
+from sqlalchemy.orm import load_only, joinedload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy import event
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
+from werkzeug.datastructures import MultiDict
 from flask_migrate import Migrate
 import config
 import sys
-from datetime import datetime
+import time
+import threading
+import random
+import bisect
+from itertools import groupby
+from functools import lru_cache, wraps
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from collections import namedtuple, OrderedDict, deque
 
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
+class RoutingSession(SignallingSession):
+  '''
+  Session that sends reads from replica-enabled requests to a replica
+  engine. Flushes, and everything else, go to the primary.
+  '''
+  def get_bind(self, mapper=None, clause=None):
+    if not self._flushing:
+      replica = replica_engine()
+      if replica is not None:
+        return replica
+    return super(RoutingSession, self).get_bind(mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = config.SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 migrate = Migrate(app, db)
 
+#----------------------------------------------------------------------------#
+# Connection pool.
+#----------------------------------------------------------------------------#
+
+class InstrumentedQueuePool(QueuePool):
+  '''
+  QueuePool that records how long each checkout waited for a connection
+  into the metrics of its engine.
+  '''
+  metrics = None
+
+  def _do_get(self):
+    started = time.perf_counter()
+    try:
+      return super(InstrumentedQueuePool, self)._do_get()
+    finally:
+      if self.metrics is not None:
+        self.metrics.record_wait(time.perf_counter() - started)
+
+  def recreate(self):
+    # engine.dispose() swaps in a new pool, which keeps recording here
+    pool = super(InstrumentedQueuePool, self).recreate()
+    pool.metrics = self.metrics
+    return pool
+
+class PoolMetrics(object):
+  '''
+  Checkout counts, checkout wait and connection age for the engine's pool.
+  '''
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._opened = {}
+    self.engine = None
+    self.connects = 0
+    self.checkouts = 0
+    self.wait_count = 0
+    self.wait_seconds_total = 0.0
+    self.wait_seconds_max = 0.0
+
+  def record_wait(self, seconds):
+    with self._lock:
+      self.wait_count += 1
+      self.wait_seconds_total += seconds
+      self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+  def instrument(self, engine):
+    # Listening on the engine keeps the hooks across pool re-creation
+    self.engine = engine
+    if isinstance(engine.pool, InstrumentedQueuePool):
+      engine.pool.metrics = self
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+      with self._lock:
+        self.connects += 1
+        self._opened[id(connection_record)] = time.time()
+
+    @event.listens_for(engine, 'close')
+    def on_close(dbapi_connection, connection_record):
+      with self._lock:
+        self._opened.pop(id(connection_record), None)
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+      with self._lock:
+        self.checkouts += 1
+
+  def format(self):
+    now = time.time()
+    with self._lock:
+      ages = [now - opened for opened in self._opened.values()]
+      metrics = {
+        "connects": self.connects,
+        "checkouts": self.checkouts,
+        "wait_count": self.wait_count,
+        "wait_seconds_total": self.wait_seconds_total,
+        "wait_seconds_max": self.wait_seconds_max,
+        "connections_open": len(ages),
+        "connection_age_seconds_max": max(ages) if ages else 0.0,
+        "connection_age_seconds_avg": sum(ages) / len(ages) if ages else 0.0,
+      }
+    pool = self.engine.pool if self.engine is not None else None
+    if isinstance(pool, QueuePool):
+      metrics.update({
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+      })
+    return metrics
+
+# PoolMetrics by bind: 'primary' and one per read replica
+pool_metrics = {}
+
+def instrument_pool(bind, engine):
+  pool_metrics[bind] = PoolMetrics()
+  pool_metrics[bind].instrument(engine)
+
+def config_setting(name, default):
+  # config.py wins over the environment
+  return app.config.get(name, os.environ.get(name, default))
+
+def engine_options(database_uri):
+  '''
+  returns SQLAlchemy engine options for database_uri from the DB_POOL_*
+  settings. SQLite keeps its own pool class, so sizing only applies to
+  server databases.
+  '''
+  options = {
+    'pool_pre_ping': str(config_setting('DB_POOL_PRE_PING', 'true')).lower() in ('1', 'true', 'yes'),
+    'pool_recycle': int(config_setting('DB_POOL_RECYCLE', 1800)),
+  }
+  if not database_uri.startswith('sqlite'):
+    options.update({
+      'poolclass': InstrumentedQueuePool,
+      'pool_size': int(config_setting('DB_POOL_SIZE', 5)),
+      'max_overflow': int(config_setting('DB_MAX_OVERFLOW', 10)),
+      'pool_timeout': int(config_setting('DB_POOL_TIMEOUT', 30)),
+    })
+  return options
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+instrument_pool('primary', db.engine)
+
+@event.listens_for(db.engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+  # SQLite only enforces foreign keys, and their ON DELETE CASCADE, when asked
+  if db.engine.dialect.name == 'sqlite':
+    dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+#----------------------------------------------------------------------------#
+# Request metrics.
+#----------------------------------------------------------------------------#
+
+# Upper bounds, in seconds, of the per-endpoint latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class EndpointStats(object):
+  def __init__(self):
+    self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+    self.count = 0
+    self.seconds = 0.0
+    self.queries = 0
+    self.db_seconds = 0.0
+    self.render_seconds = 0.0
+
+class RequestMetrics(object):
+  '''
+  Per-endpoint request latency histograms plus SQL query counts and time,
+  exported in the Prometheus text format.
+  '''
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._endpoints = {}
+
+  def instrument(self, engine):
+    # Statements run outside a request (CLI, startup) are not counted
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+      if has_request_context():
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+      started = conn.info.get('query_started')
+      if started and has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_seconds = g.get('db_seconds', 0.0) + time.perf_counter() - started.pop()
+
+  def record(self, endpoint, seconds, queries, db_seconds, render_seconds):
+    with self._lock:
+      stats = self._endpoints.get(endpoint)
+      if stats is None:
+        stats = self._endpoints[endpoint] = EndpointStats()
+      stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+      stats.count += 1
+      stats.seconds += seconds
+      stats.queries += queries
+      stats.db_seconds += db_seconds
+      stats.render_seconds += render_seconds
+
+  def format(self):
+    lines = [
+      '# HELP fyyur_request_duration_seconds Request latency by endpoint.',
+      '# TYPE fyyur_request_duration_seconds histogram',
+    ]
+    totals = []
+    with self._lock:
+      for endpoint, stats in sorted(self._endpoints.items()):
+        label = 'endpoint="%s"' % endpoint
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.buckets):
+          cumulative += count
+          lines.append('fyyur_request_duration_seconds_bucket{%s,le="%s"} %d' % (label, bound, cumulative))
+        lines.append('fyyur_request_duration_seconds_sum{%s} %f' % (label, stats.seconds))
+        lines.append('fyyur_request_duration_seconds_count{%s} %d' % (label, stats.count))
+        totals.append((label, stats.queries, stats.db_seconds, stats.render_seconds))
+    for name, index, help_text in (
+      ('fyyur_db_queries_total', 1, 'SQL statements executed, by endpoint.'),
+      ('fyyur_db_seconds_total', 2, 'Time spent in SQL statements, by endpoint.'),
+      ('fyyur_render_seconds_total', 3, 'Time spent rendering templates, by endpoint.'),
+    ):
+      lines.append('# HELP %s %s' % (name, help_text))
+      lines.append('# TYPE %s counter' % name)
+      for row in totals:
+        lines.append('%s{%s} %s' % (name, row[0], row[index]))
+    pools = [(bind, metrics.format()) for bind, metrics in sorted(pool_metrics.items())]
+    for key in sorted(set().union(*(values for bind, values in pools))):
+      lines.append('# TYPE fyyur_pool_%s gauge' % key)
+      for bind, values in pools:
+        if key in values:
+          lines.append('fyyur_pool_%s{bind="%s"} %s' % (key, bind, values[key]))
+    return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+request_metrics.instrument(db.engine)
+
+def render_template(template_name, **context):
+  '''
+  flask's render_template, timed into the request's render total. Nested
+  renders (cached fragments inside a page) are counted once.
+  '''
+  if not has_request_context() or g.get('rendering'):
+    return flask_render_template(template_name, **context)
+  g.rendering = True
+  started = time.perf_counter()
+  try:
+    return flask_render_template(template_name, **context)
+  finally:
+    g.rendering = False
+    g.render_seconds = g.get('render_seconds', 0.0) + time.perf_counter() - started
+
+@app.before_request
+def start_request_timer():
+  g.db_queries = 0
+  g.db_seconds = 0.0
+  g.render_seconds = 0.0
+  g.request_started = time.perf_counter()
+
+@app.after_request
+def add_server_timing(response):
+  '''
+  adds a Server-Timing header (db, render, total) and records the request
+  in the endpoint's histogram. Streamed bodies render after this runs, so
+  for them only the time to the first byte is measured.
+  '''
+  started = g.get('request_started')
+  if started is None:
+    return response
+  total = time.perf_counter() - started
+  queries = g.get('db_queries', 0)
+  db_seconds = g.get('db_seconds', 0.0)
+  render_seconds = g.get('render_seconds', 0.0)
+  response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries", render;dur=%.2f, total;dur=%.2f'
+    % (db_seconds * 1000, queries, render_seconds * 1000, total * 1000))
+  request_metrics.record(request.endpoint or 'unmatched', total, queries, db_seconds, render_seconds)
+  return response
+
+#----------------------------------------------------------------------------#
+# Read replicas.
+#----------------------------------------------------------------------------#
+
+# Seconds a client keeps reading from the primary after one of its
+# requests commits, so it sees its own writes despite replica lag
+REPLICA_STICKY_SECONDS = float(config_setting('DB_REPLICA_STICKY_SECONDS', 5))
+
+def replica_uris():
+  uris = config_setting('DATABASE_REPLICA_URLS', '')
+  if isinstance(uris, str):
+    uris = [uri.strip() for uri in uris.split(',') if uri.strip()]
+  return list(uris)
+
+REPLICA_BINDS = ['replica_%d' % i for i in range(len(replica_uris()))]
+app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {},
+  **dict(zip(REPLICA_BINDS, replica_uris())))
+for bind in REPLICA_BINDS:
+  instrument_pool(bind, db.get_engine(app, bind=bind))
+  request_metrics.instrument(db.get_engine(app, bind=bind))
+
+def replica_reads(f):
+  '''
+  marks a read-only view whose queries may be served by a replica.
+  '''
+  @wraps(f)
+  def decorated(*args, **kwargs):
+    g.replica_reads = True
+    return f(*args, **kwargs)
+  return decorated
+
+@contextmanager
+def primary_reads():
+  '''
+  sends reads in the block to the primary, e.g. to build shared caches
+  that must not be filled from a lagging replica.
+  '''
+  if not has_request_context():
+    yield
+    return
+  previous = g.get('primary_reads', False)
+  g.primary_reads = True
+  try:
+    yield
+  finally:
+    g.primary_reads = previous
+
+def replica_engine():
+  '''
+  returns the replica engine for this request's reads, or None when they
+  should go to the primary. Each request sticks to one replica.
+  '''
+  if not REPLICA_BINDS or not has_request_context():
+    return None
+  if not g.get('replica_reads') or g.get('primary_reads'):
+    return None
+  if time.time() < session.get('read_primary_until', 0):
+    return None
+  if 'replica_bind' not in g:
+    g.replica_bind = random.choice(REPLICA_BINDS)
+  return db.get_engine(app, bind=g.replica_bind)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def mark_committed(db_session):
+  if has_request_context():
+    g.db_committed = True
+
+@app.after_request
+def stick_to_primary(response):
+  if REPLICA_BINDS and g.get('db_committed'):
+    session['read_primary_until'] = time.time() + REPLICA_STICKY_SECONDS
+  return response
+
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
 class Venue(db.Model):
   __tablename__ = 'venues'
+  __table_args__ = (
+    db.Index('ix_venues_genres', 'genres', postgresql_using='gin'),
+    db.Index('ix_venues_state_city', 'state', 'city'),
+    db.Index('ix_venues_deleted_ts', 'deleted_ts',
+      postgresql_where=db.text('deleted_ts IS NOT NULL'), sqlite_where=db.text('deleted_ts IS NOT NULL')),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String, nullable=False)
@@ -49,139 +424,1409 @@ class Venue(db.Model):
   image_link = db.Column(db.String(500))
   facebook_link = db.Column(db.String(120))
 
-  genres = db.Column(db.ARRAY(db.String(120)))
+  genres = db.Column(db.ARRAY(db.String(120)).with_variant(db.JSON(), 'sqlite'))
   website = db.Column(db.String(120))
   sticky_title = db.Column(db.String(120))
   sticky_message = db.Column(db.String(120))
-  artists = db.relationship('Show', back_populates="venue")
-  created_ts = db.Column(db.DateTime)
+  artists = db.relationship('Show', back_populates="venue", passive_deletes=True)
+  created_ts = db.Column(db.DateTime, index=True)
+  # Maintained by the Show counter hooks and roll_show_counters()
+  upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  # UTC time of the last change to anything its page shows, for ETag and
+  # Last-Modified
+  updated_ts = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+  # Set when the venue is deleted; it is hidden at once and purged, with
+  # its shows, by purge_deleted()
+  deleted_ts = db.Column(db.DateTime)
 
   def __repr__(self):
     return f'<Venue {self.id} {self.name}>'
 
 class Artist(db.Model):
   __tablename__ = 'artists'
+  __table_args__ = (
+    db.Index('ix_artists_name_id', 'name', 'id'),
+    db.Index('ix_artists_genres', 'genres', postgresql_using='gin'),
+    db.Index('ix_artists_deleted_ts', 'deleted_ts',
+      postgresql_where=db.text('deleted_ts IS NOT NULL'), sqlite_where=db.text('deleted_ts IS NOT NULL')),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String, nullable=False)
   city = db.Column(db.String(120), nullable=False)
   state = db.Column(db.String(120), nullable=False)
   phone = db.Column(db.String(120), nullable=False)
-  genres = db.Column(db.ARRAY(db.String(120)))
+  genres = db.Column(db.ARRAY(db.String(120)).with_variant(db.JSON(), 'sqlite'))
   image_link = db.Column(db.String(500))
   facebook_link = db.Column(db.String(120))
 
   website = db.Column(db.String(120))
   sticky_title = db.Column(db.String(120))
   sticky_message = db.Column(db.String(120))
-  venues = db.relationship('Show', back_populates='artist')
-  created_ts = db.Column(db.DateTime)
-  available_booking_times = db.Column(db.ARRAY(db.DateTime), nullable=False)
+  venues = db.relationship('Show', back_populates='artist', passive_deletes=True)
+  created_ts = db.Column(db.DateTime, index=True)
+  upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  updated_ts = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+  deleted_ts = db.Column(db.DateTime)
+  available_booking_times = db.Column(db.ARRAY(db.DateTime).with_variant(db.JSON(), 'sqlite'), nullable=False)
 
 class Show(db.Model):
   __tablename__ = 'shows'
+  __table_args__ = (
+    db.Index('ix_shows_start_time_artist_id_venue_id', 'start_time', 'artist_id', 'venue_id'),
+    db.Index('ix_shows_counted_upcoming_start_time', 'start_time',
+      postgresql_where=db.text('counted_upcoming'), sqlite_where=db.text('counted_upcoming')),
+    # Time-window queries, narrowed to a set of venues by index alone
+    db.Index('ix_shows_start_time_venue_id', 'start_time', 'venue_id'),
+    # Foreign key lookups, and one venue's shows over a window
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+  )
 
-  artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), primary_key=True)
-  venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), primary_key=True)
+  artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True)
+  venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
   start_time = db.Column(db.DateTime, primary_key=True)
+  # Length of the show in minutes. On Postgres, exclusion constraints
+  # (see migration c93f04d6e1a7) stop an artist or a venue from having two
+  # overlapping shows.
+  duration = db.Column(db.Integer, nullable=False, default=120, server_default='120')
+  # Whether the show is in its venue's and artist's upcoming_shows_count
+  # rather than past_shows_count, until roll_show_counters() moves it
+  counted_upcoming = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
   artist = db.relationship('Artist', back_populates='venues')
   venue = db.relationship('Venue', back_populates='artists')
-  
+
+  @property
+  def end_time(self):
+    return self.start_time + timedelta(minutes=self.duration)
+
+class BookingSlot(db.Model):
+  '''
+  A time an artist is available to be booked. Replaces scanning every
+  artist's available_booking_times array; the label is formatted once,
+  when the slot is stored.
+  '''
+  __tablename__ = 'booking_slots'
+  __table_args__ = (
+    db.UniqueConstraint('artist_id', 'start_time', name='uq_booking_slots_artist_id_start_time'),
+    db.Index('ix_booking_slots_start_time_artist_id', 'start_time', 'artist_id'),
+  )
+
+  id = db.Column(db.Integer, primary_key=True)
+  artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), nullable=False)
+  start_time = db.Column(db.DateTime, nullable=False)
+  label = db.Column(db.String(120), nullable=False)
+  artist = db.relationship('Artist')
+
+  def __init__(self, artist_id, start_time):
+    self.artist_id = artist_id
+    self.start_time = start_time
+    self.label = format_datetime(start_time)
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+# How often roll_show_counters() is expected to run, which bounds how far
+# behind the clock the counters can be
+SHOW_COUNTER_ROLL_SECONDS = int(config_setting('SHOW_COUNTER_ROLL_SECONDS', 60))
+
+def update_show_counters(execute, shows, sign=1):
+  '''
+  adds (or with sign=-1, removes) shows to their venues' and artists'
+  upcoming/past counters, as one executemany per table, and bumps their
+  updated_ts. shows are (venue_id, artist_id, counted_upcoming) tuples;
+  execute runs statements in the caller's transaction. Rows are updated
+  artists first, then venues, each in id order, the same order
+  check_listed() locks them in, so concurrent writers do not deadlock.
+  '''
+  for model, key in ((Artist, 1), (Venue, 0)):
+    deltas = {}
+    for show in shows:
+      upcoming, past = deltas.get(show[key], (0, 0))
+      deltas[show[key]] = (upcoming + 1, past) if show[2] else (upcoming, past + 1)
+    if not deltas:
+      continue
+    table = model.__table__
+    execute(
+      table.update()
+        .where(table.c.id == db.bindparam('_id'))
+        .values(
+          upcoming_shows_count=table.c.upcoming_shows_count + db.bindparam('_upcoming'),
+          past_shows_count=table.c.past_shows_count + db.bindparam('_past'),
+          updated_ts=datetime.utcnow()),
+      [{'_id': id, '_upcoming': sign * upcoming, '_past': sign * past}
+        for id, (upcoming, past) in sorted(deltas.items())]
+    )
+
+@event.listens_for(Show, 'before_insert')
+def classify_new_show(mapper, connection, show):
+  show.counted_upcoming = show.start_time >= datetime.now()
+
+@event.listens_for(Show, 'after_insert')
+def count_inserted_show(mapper, connection, show):
+  update_show_counters(connection.execute, [(show.venue_id, show.artist_id, show.counted_upcoming)])
+
+@event.listens_for(Show, 'after_delete')
+def uncount_deleted_show(mapper, connection, show):
+  update_show_counters(connection.execute, [(show.venue_id, show.artist_id, show.counted_upcoming)], sign=-1)
+
+def roll_show_counters(now=None):
+  '''
+  moves shows that have started since the last run from upcoming to past
+  in their venues' and artists' counters, and returns how many moved. Rows
+  are locked (skipping those another run holds), so concurrent runs never
+  move a show twice.
+  '''
+  now = now or datetime.now()
+  due = (db.session.query(Show.artist_id, Show.venue_id, Show.start_time)
+    .filter(Show.counted_upcoming, Show.start_time < now)
+    .with_for_update(skip_locked=True)
+    .all()
+  )
+  if not due:
+    db.session.rollback()
+    return 0
+  shows = Show.__table__
+  db.session.execute(
+    shows.update()
+      .where(and_(
+        shows.c.artist_id == db.bindparam('_artist_id'),
+        shows.c.venue_id == db.bindparam('_venue_id'),
+        shows.c.start_time == db.bindparam('_start_time')))
+      .values(counted_upcoming=False),
+    [{'_artist_id': a, '_venue_id': v, '_start_time': t} for a, v, t in due]
+  )
+  update_show_counters(db.session.execute, [(v, a, True) for a, v, _ in due], sign=-1)
+  update_show_counters(db.session.execute, [(v, a, False) for a, v, _ in due])
+  db.session.commit()
+  return len(due)
+
+@app.cli.command('roll-show-counters')
+@click.option('--every', type=int, default=None,
+  help='Keep running, rolling every N seconds (e.g. SHOW_COUNTER_ROLL_SECONDS).')
+def roll_show_counters_command(every):
+  '''Move started shows from the upcoming to the past show counters.'''
+  while True:
+    moved = roll_show_counters()
+    click.echo(f'{moved} shows moved to past')
+    if every is None:
+      break
+    time.sleep(every)
+
+#----------------------------------------------------------------------------#
+# Purge.
+#----------------------------------------------------------------------------#
+
+# Shows deleted per transaction, and the pause between transactions, so a
+# venue with many shows never holds locks or a connection for long
+PURGE_BATCH_SIZE = int(config_setting('PURGE_BATCH_SIZE', 1000))
+PURGE_PAUSE_SECONDS = float(config_setting('PURGE_PAUSE_SECONDS', 0.05))
+
+def purge_batch(key, id, batch_size):
+  '''
+  deletes up to batch_size shows where key == id and takes them off the
+  counters of their venues and artists. Returns how many were deleted.
+  '''
+  rows = (db.session.query(Show.artist_id, Show.venue_id, Show.start_time, Show.counted_upcoming)
+    .filter(key==id)
+    .limit(batch_size)
+    .with_for_update(skip_locked=True)
+    .all()
+  )
+  if not rows:
+    return 0
+  shows = Show.__table__
+  db.session.execute(
+    shows.delete().where(and_(
+      shows.c.artist_id == db.bindparam('_artist_id'),
+      shows.c.venue_id == db.bindparam('_venue_id'),
+      shows.c.start_time == db.bindparam('_start_time'))),
+    [{'_artist_id': a, '_venue_id': v, '_start_time': t} for a, v, t, _ in rows]
+  )
+  update_show_counters(db.session.execute, [(v, a, upcoming) for a, v, _, upcoming in rows], sign=-1)
+  return len(rows)
+
+def purge_deleted(batch_size=PURGE_BATCH_SIZE, pause=PURGE_PAUSE_SECONDS):
+  '''
+  removes soft-deleted venues and artists. Their shows go first, in
+  batches of batch_size with one commit each; the row itself goes last,
+  and ON DELETE CASCADE takes any booking slots or shows added meanwhile.
+  Returns the number of shows purged.
+  '''
+  purged = 0
+  for model, key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    ids = [id for id, in db.session.query(model.id)
+      .filter(model.deleted_ts.isnot(None))
+      .order_by(model.deleted_ts)]
+    for id in ids:
+      while True:
+        deleted = purge_batch(key, id, batch_size)
+        db.session.commit()
+        purged += deleted
+        if deleted < batch_size:
+          break
+        time.sleep(pause)
+      model.query.filter(model.id==id, model.deleted_ts.isnot(None)).delete(synchronize_session=False)
+      db.session.commit()
+  return purged
+
+@app.cli.command('purge-deleted')
+@click.option('--every', type=int, default=None,
+  help='Keep running, purging every N seconds.')
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, show_default=True)
+def purge_deleted_command(every, batch_size):
+  '''Remove deleted venues and artists and their shows, in batches.'''
+  while True:
+    purged = purge_deleted(batch_size)
+    click.echo(f'{purged} shows purged')
+    if every is None:
+      break
+    time.sleep(every)
+
+#----------------------------------------------------------------------------#
+# Loading profiles.
+#----------------------------------------------------------------------------#
+
+# Named eager-loading profiles for Show queries. Each profile loads only the
+# related columns its templates read, in the same statement as the shows, so
+# rendering a list of show tiles never lazy-loads per tile.
+SHOW_TILE_COLUMNS = ('id', 'name', 'image_link')
+
+SHOW_LOADING_PROFILES = {
+  # Show tiles with both the artist and the venue, as on /shows
+  'tiles': (
+    joinedload(Show.artist, innerjoin=True).load_only(*SHOW_TILE_COLUMNS),
+    joinedload(Show.venue, innerjoin=True).load_only(*SHOW_TILE_COLUMNS),
+  ),
+  # Show tiles on a venue page, where the venue is already known
+  'venue_tiles': (
+    joinedload(Show.artist, innerjoin=True).load_only(*SHOW_TILE_COLUMNS),
+  ),
+  # Show tiles on an artist page, where the artist is already known
+  'artist_tiles': (
+    joinedload(Show.venue, innerjoin=True).load_only(*SHOW_TILE_COLUMNS),
+  ),
+}
+
+def live_shows():
+  '''
+  returns criteria that hide shows of deleted venues and artists until
+  purge_deleted() removes them. The subqueries read the small partial
+  deleted_ts indexes.
+  '''
+  return (
+    Show.venue_id.notin_(db.session.query(Venue.id).filter(Venue.deleted_ts.isnot(None))),
+    Show.artist_id.notin_(db.session.query(Artist.id).filter(Artist.deleted_ts.isnot(None))),
+  )
+
+def show_query(profile):
+  '''
+  returns a Show query that eager-loads relationships using the named
+  profile, without shows of deleted venues and artists
+  '''
+  return Show.query.options(*SHOW_LOADING_PROFILES[profile]).filter(*live_shows())
+
+def show_filters(args):
+  '''
+  returns (criteria, filters) for the ?city=&state=&from=&to= show filters:
+  SQL criteria for a Show query, and the filters that were given, to carry
+  into pager links. from is inclusive and to exclusive. Location narrows
+  through an IN subquery on venues, so the planner can use the venue
+  (state, city) index and then either shows index for the window.
+  '''
+  criteria, filters = [], {}
+  city, state = args.get('city'), args.get('state')
+  if city or state:
+    venue_ids = db.session.query(Venue.id).filter(Venue.deleted_ts.is_(None))
+    if state:
+      venue_ids = venue_ids.filter(Venue.state==state)
+      filters['state'] = state
+    if city:
+      venue_ids = venue_ids.filter(Venue.city==city)
+      filters['city'] = city
+    criteria.append(Show.venue_id.in_(venue_ids))
+  for name, compare in (('from', Show.start_time.__ge__), ('to', Show.start_time.__lt__)):
+    if args.get(name):
+      try:
+        value = dateutil.parser.parse(args[name])
+      except (ValueError, OverflowError):
+        abort(400)
+      if value.tzinfo is not None:
+        # Show times are naive local times, so convert before dropping the offset
+        value = value.astimezone().replace(tzinfo=None)
+      criteria.append(compare(value))
+      filters[name] = args[name]
+  return criteria, filters
+
+def partition_shows(query):
+  '''
+  runs a Show query once and returns (upcoming_shows, past_shows), split by
+  the database clock. Upcoming shows come soonest first, past shows most
+  recent first.
+  '''
+  upcoming_shows, past_shows = [], []
+  rows = (query
+    .add_columns((Show.start_time >= func.now()).label('is_upcoming'))
+    .order_by(Show.start_time)
+  )
+  for show, is_upcoming in rows:
+    (upcoming_shows if is_upcoming else past_shows).append(show)
+  past_shows.reverse()
+  return upcoming_shows, past_shows
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+# Named formats that Babel resolves per locale rather than as patterns
+BABEL_NAMED_FORMATS = ('short', 'long')
+DATETIME_LOCALE = babel.dates.LC_TIME or 'en_US_POSIX'
+FORMATTED_DATETIME_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=64)
+def datetime_pattern(format, locale):
+  '''
+  returns the compiled Babel pattern and the parsed locale for a format
+  '''
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+def to_datetime(value):
   if not isinstance(value, datetime):
-    date = dateutil.parser.parse(value)
-  else:
-    date = value
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+    return dateutil.parser.parse(value)
+  return value
+
+@lru_cache(maxsize=FORMATTED_DATETIME_CACHE_SIZE)
+def format_datetime(value, format='medium', locale=DATETIME_LOCALE):
+  if format in BABEL_NAMED_FORMATS:
+    return babel.dates.format_datetime(to_datetime(value), format, locale=locale)
+  pattern, locale = datetime_pattern(format, locale)
+  return pattern.apply(to_datetime(value), locale)
+
+def format_datetimes(values, format='medium', locale=DATETIME_LOCALE):
+  '''
+  formats a list of datetimes (or datetime strings) in one call, resolving
+  the pattern once and formatting each distinct value once
+  '''
+  if format in BABEL_NAMED_FORMATS:
+    return [format_datetime(v, format, locale) for v in values]
+  pattern, locale = datetime_pattern(format, locale)
+  formatted = {}
+  for value in values:
+    if value not in formatted:
+      formatted[value] = pattern.apply(to_datetime(value), locale)
+  return [formatted[v] for v in values]
 
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.filters['datetimes'] = format_datetimes
+
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+PAGE_SIZE = 20
+
+Page = namedtuple('Page', ['items', 'next', 'prev'])
+
+def encode_cursor(values):
+  '''
+  encodes a list of key values into an opaque, url-safe cursor token
+  '''
+  raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+  return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(token, columns):
+  '''
+  decodes a cursor token back into key values typed after the given columns
+  '''
+  try:
+    raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    values = json.loads(raw)
+    if len(values) != len(columns):
+      raise ValueError(token)
+    return [
+      datetime.fromisoformat(v) if c.type.python_type is datetime else c.type.python_type(v)
+      for c, v in zip(columns, values)
+    ]
+  except Exception:
+    abort(400)
+
+def keyset_page(query, columns, key, after=None, before=None, per_page=PAGE_SIZE):
+  '''
+  returns one Page of query, ordered by columns, that starts after the `after`
+  cursor or ends before the `before` cursor. key(row) returns the row's values
+  for columns. Pages are found by seeking on the key instead of OFFSET, so
+  every page costs the same however deep it is.
+  '''
+  forward = before is None or after is not None
+  cursor = after if forward else before
+  if cursor is not None:
+    values = decode_cursor(cursor, columns)
+    if forward:
+      query = query.filter(tuple_(*columns) > tuple_(*values))
+    else:
+      query = query.filter(tuple_(*columns) < tuple_(*values))
+  order = [asc(c) for c in columns] if forward else [desc(c) for c in columns]
+  rows = query.order_by(*order).limit(per_page + 1).all()
+  has_more = len(rows) > per_page
+  rows = rows[:per_page]
+  if not forward:
+    rows.reverse()
+  if not rows:
+    return Page(rows, None, None)
+  first, last = encode_cursor(key(rows[0])), encode_cursor(key(rows[-1]))
+  if forward:
+    return Page(rows, last if has_more else None, first if cursor is not None else None)
+  return Page(rows, last, first if has_more else None)
+
+# Typed key of list_page() cursors, for decode_cursor()
+LIST_POSITION = (literal_column('position', db.Integer),)
+
+def list_page(items, after=None, before=None, per_page=PAGE_SIZE):
+  '''
+  returns one Page of an already ordered in-memory list, with the same
+  after/before cursors as keyset_page(). The cursors hold list positions.
+  '''
+  if before is not None and after is None:
+    end = max(decode_cursor(before, LIST_POSITION)[0], 0)
+    start = max(end - per_page, 0)
+  else:
+    start = max(decode_cursor(after, LIST_POSITION)[0] + 1, 0) if after is not None else 0
+    end = start + per_page
+  rows = items[start:end]
+  if not rows:
+    return Page(rows, None, None)
+  end = start + len(rows)
+  return Page(rows,
+    encode_cursor([end - 1]) if end < len(items) else None,
+    encode_cursor([start]) if start > 0 else None)
+
+def wants_json():
+  '''
+  returns whether the client asked for a JSON response instead of HTML
+  '''
+  if request.args.get('format') == 'json':
+    return True
+  best = request.accept_mimetypes.best_match(['text/html', 'application/json'])
+  return best == 'application/json'
+
+#----------------------------------------------------------------------------#
+# Streaming.
+#----------------------------------------------------------------------------#
+
+# Template chunks buffered per write, and rows fetched per round trip
+STREAM_BUFFER_SIZE = 5
+STREAM_BATCH_SIZE = 500
+
+def stream_template(template_name, **context):
+  '''
+  renders a template as a streamed response. Output is sent as the
+  template is rendered, so time to first byte and memory do not grow with
+  the page. Pass generators (e.g. yield_per queries) to keep rows from
+  being held in memory too.
+  '''
+  app.update_template_context(context)
+  # Pop flashed messages now, while the session can still be saved
+  get_flashed_messages()
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  stream.enable_buffering(STREAM_BUFFER_SIZE)
+  return Response(stream_with_context(stream))
+
+#----------------------------------------------------------------------------#
+# Conditional requests.
+#----------------------------------------------------------------------------#
+
+# Part of every page ETag, so a deploy that changes templates does not leave
+# clients revalidating pages rendered by the old ones
+TEMPLATE_VERSION = max(
+  (int(os.path.getmtime(os.path.join(root, name)))
+    for root, _, names in os.walk(os.path.join(app.root_path, app.template_folder))
+    for name in names),
+  default=0
+)
+
+def touch_pages(model, key, condition):
+  '''
+  bumps updated_ts of the model rows whose show tiles match condition,
+  e.g. the artists that play a venue that was just edited.
+  '''
+  model.query.filter(model.id.in_(db.session.query(key).filter(condition))) \
+    .update({'updated_ts': datetime.utcnow()}, synchronize_session=False)
+
+def conditional_page(kind, id, updated_ts, render):
+  '''
+  serves a detail page with ETag and Last-Modified validators derived from
+  updated_ts. When the client's copy is current, returns 304 without
+  calling render(). Pages with flashed messages waiting are always sent.
+  '''
+  etag = f'{kind}-{id}-{updated_ts:%Y%m%d%H%M%S%f}-{TEMPLATE_VERSION}'
+  last_modified = updated_ts.replace(microsecond=0)
+  if '_flashes' in session:
+    fresh = False
+  elif request.if_none_match:
+    fresh = request.if_none_match.contains_weak(etag)
+  else:
+    fresh = request.if_modified_since is not None and request.if_modified_since >= last_modified
+  response = Response(status=304) if fresh else make_response(render())
+  response.set_etag(etag, weak=True)
+  response.last_modified = last_modified
+  response.cache_control.private = True
+  response.cache_control.no_cache = True
+  return response
+
+#----------------------------------------------------------------------------#
+# Caches.
+#----------------------------------------------------------------------------#
+
+class LazyCache(object):
+  '''
+  Base class for in-process caches that are built on first use and rebuilt
+  after invalidate() or once they expire. Subclasses implement _build(),
+  which returns the cached value and its expiry time (or None). A build that
+  races with an invalidation or a write is returned to its caller but not
+  kept. Only one thread builds at a time: others wait for it when there is
+  no value, and keep serving the expired value while it is being refreshed.
+  '''
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._build_lock = threading.Lock()
+    self._generation = 0
+    self._building = False
+    self._value = None
+    self._expires_at = None
+
+  def _current(self):
+    '''
+    returns (generation, value if still fresh, value even if expired)
+    '''
+    with self._lock:
+      value = self._value
+      fresh = value is not None and (self._expires_at is None or datetime.now() < self._expires_at)
+      return self._generation, value if fresh else None, value
+
+  def get(self):
+    _, value, stale = self._current()
+    if value is not None:
+      return value
+    if stale is not None:
+      if not self._build_lock.acquire(blocking=False):
+        return stale
+    else:
+      self._build_lock.acquire()
+    try:
+      # Another thread may have built it while this one waited
+      generation, value, _ = self._current()
+      if value is not None:
+        return value
+      with self._lock:
+        self._building = True
+      try:
+        with primary_reads():
+          value, expires_at = self._build()
+      except:
+        with self._lock:
+          self._building = False
+        raise
+      with self._lock:
+        self._building = False
+        if generation == self._generation:
+          self._value = value
+          self._expires_at = expires_at
+      return value
+    finally:
+      self._build_lock.release()
+
+  def _note_write(self):
+    '''
+    called by subclasses with _lock held before applying a write to _value.
+    A build in flight may have read the rows before the write, so it will
+    not be kept. Returns True when there is no value to apply the write to.
+    '''
+    if self._value is None or self._building:
+      self._generation += 1
+    return self._value is None
+
+  def invalidate(self):
+    with self._lock:
+      self._generation += 1
+      self._value = None
+      self._expires_at = None
+
+  def _build(self):
+    raise NotImplementedError
+
+class AreaIndex(LazyCache):
+  '''
+  In-process index of venues grouped by area (city, state), read from the
+  venues table and its upcoming show counters. The counters only change
+  between roll_show_counters() runs and local show writes (which
+  invalidate the index), so the index expires after one roll interval.
+  '''
+  def _build(self):
+    rows = (db.session.query(
+        Venue.id, Venue.name, Venue.city, Venue.state,
+        Venue.upcoming_shows_count.label('num_upcoming_shows'))
+      .filter(Venue.deleted_ts.is_(None))
+      .order_by(Venue.state, Venue.city, Venue.name)
+      .all()
+    )
+    areas = []
+    for (city, state), venues in groupby(rows, key=lambda r: (r.city, r.state)):
+      areas.append({
+        "city": city,
+        "state": state,
+        "venues": [{
+          "id": v.id,
+          "name": v.name,
+          "num_upcoming_shows": v.num_upcoming_shows
+        } for v in venues]
+      })
+    return areas, datetime.now() + timedelta(seconds=SHOW_COUNTER_ROLL_SECONDS)
+
+area_index = AreaIndex()
+
+def popcount(bits):
+  return bin(bits).count('1')
+
+def set_bits(bits):
+  '''
+  returns the positions of the set bits in bits, lowest first
+  '''
+  digits = bin(bits)[:1:-1]
+  positions = []
+  position = digits.find('1')
+  while position != -1:
+    positions.append(position)
+    position = digits.find('1', position + 1)
+  return positions
+
+class FacetIndex(LazyCache):
+  '''
+  In-process bitmaps of a model's rows per genre and per state, built from
+  one query. Rows are numbered densely as they are read, and bit n of a
+  bitmap is set when row n has that genre (or state), so filtering is a
+  bitwise AND and a facet count is the popcount of one more AND, with no
+  rows loaded per request. Other worker processes' writes are picked up
+  when the index expires, on the same interval as the area index.
+  '''
+  def __init__(self, model):
+    super(FacetIndex, self).__init__()
+    self.model = model
+
+  def _build(self):
+    model = self.model
+    ids, genres, states = [], {}, {}
+    rows = db.session.query(model.id, model.state, model.genres).filter(model.deleted_ts.is_(None))
+    for id, state, row_genres in rows:
+      bit = 1 << len(ids)
+      ids.append(id)
+      states[state] = states.get(state, 0) | bit
+      for genre in row_genres or ():
+        genres[genre] = genres.get(genre, 0) | bit
+    all_rows = (1 << len(ids)) - 1
+    index = (ids, all_rows, genres, states)
+    return index, datetime.now() + timedelta(seconds=SHOW_COUNTER_ROLL_SECONDS)
+
+  def select(self, genres=(), state=None):
+    '''
+    returns (set of the ids with all the genres and in the state, or None
+    when nothing is filtered, {genre: count}, {state: count}), counted
+    within that selection
+    '''
+    ids, selected, genre_bits, state_bits = self.get()
+    for genre in genres:
+      selected &= genre_bits.get(genre, 0)
+    if state:
+      selected &= state_bits.get(state, 0)
+    genre_counts = {g: popcount(bits & selected) for g, bits in genre_bits.items()}
+    state_counts = {s: popcount(bits & selected) for s, bits in state_bits.items()}
+    return (
+      {ids[position] for position in set_bits(selected)} if genres or state else None,
+      {g: n for g, n in sorted(genre_counts.items()) if n},
+      {s: n for s, n in sorted(state_counts.items()) if n}
+    )
+
+venue_facets = FacetIndex(Venue)
+
+FRAGMENT_CACHE_SIZE = 1024
+FRAGMENT_TIME_BUCKET = 60
+
+class FragmentCache(object):
+  '''
+  Bounded LRU of rendered page fragments, keyed on (kind, id, updated_ts,
+  time bucket). updated_ts is the same database column the page ETag is
+  derived from, so every worker process serves a fragment at least as new
+  as its ETag. The time bucket makes entries roll over as shows move from
+  upcoming to past. clear() drops everything.
+  '''
+  def __init__(self, max_entries=FRAGMENT_CACHE_SIZE, bucket_seconds=FRAGMENT_TIME_BUCKET):
+    self.max_entries = max_entries
+    self.bucket_seconds = bucket_seconds
+    self._lock = threading.Lock()
+    self._entries = OrderedDict()
+    self._generation = 0
+
+  def _key(self, kind, id, updated_ts):
+    bucket = int(time.time() // self.bucket_seconds)
+    return (self._generation, kind, id, updated_ts, bucket)
+
+  def get_or_render(self, kind, id, updated_ts, render):
+    '''
+    returns the cached fragment for the entity at updated_ts, calling
+    render() on a miss. Nothing is cached when render() returns None.
+    '''
+    with self._lock:
+      key = self._key(kind, id, updated_ts)
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        return self._entries[key]
+    with primary_reads():
+      value = render()
+    if value is None:
+      return None
+    with self._lock:
+      # Drop the result if everything was cleared while it was being rendered
+      if key[0] == self._generation:
+        self._entries[key] = value
+        while len(self._entries) > self.max_entries:
+          self._entries.popitem(last=False)
+    return value
+
+  def clear(self):
+    with self._lock:
+      self._generation += 1
+      self._entries.clear()
+
+fragment_cache = FragmentCache()
+
+RECENT_LISTINGS_SIZE = 10
+# Other worker processes do not see this one's pushes, so reseed now and then
+RECENT_LISTINGS_REFRESH_SECONDS = 60
+
+class RecentListings(LazyCache):
+  '''
+  Ring buffer of the most recently listed rows of a model, newest first,
+  seeded from the created_ts index on first use and again once it
+  expires, which picks up listings made in other worker processes. New
+  listings are pushed in as they are created; edits and deletes drop the
+  buffer so it is seeded again.
+  '''
+  def __init__(self, model, size=RECENT_LISTINGS_SIZE):
+    super(RecentListings, self).__init__()
+    self.model = model
+    self.size = size
+
+  def _build(self):
+    model = self.model
+    rows = (db.session.query(model.id, model.name)
+      .filter(model.deleted_ts.is_(None))
+      .order_by(desc(model.created_ts))
+      .limit(self.size)
+      .all()
+    )
+    recent = deque(({"id": r.id, "name": r.name} for r in rows), maxlen=self.size)
+    return recent, datetime.now() + timedelta(seconds=RECENT_LISTINGS_REFRESH_SECONDS)
+
+  def get(self):
+    value = super(RecentListings, self).get()
+    with self._lock:
+      return list(value)
+
+  def push(self, id, name):
+    with self._lock:
+      # A seed in flight may have missed this row, so it is not kept
+      if not self._note_write():
+        self._value.appendleft({"id": id, "name": name})
+
+recent_artists = RecentListings(Artist)
+recent_venues = RecentListings(Venue)
+
+def venues_changed():
+  area_index.invalidate()
+  venue_facets.invalidate()
+  search_backend.invalidate(Venue)
+  # Venue names and images also appear on artist pages
+  fragment_cache.clear()
+
+def artists_changed():
+  search_backend.invalidate(Artist)
+  # Artist names and images also appear on venue pages
+  fragment_cache.clear()
+
+def shows_changed(artist_id=None, venue_id=None):
+  # Show writes bump updated_ts of both pages, which keys their fragments
+  area_index.invalidate()
+  if artist_id is None or venue_id is None:
+    fragment_cache.clear()
+    booking_intervals.invalidate()
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+SEARCH_PAGE_SIZE = 20
+# Shorter terms have no trigram to look up, so they are matched as prefixes
+SEARCH_MIN_SUBSTRING = 3
+# Other worker processes do not see this one's updates, so rebuild now and then
+SEARCH_REFRESH_SECONDS = 300
+
+# total is None on pages after the first of a keyset search, which does not
+# count again
+SearchResult = namedtuple('SearchResult', ['total', 'items', 'next', 'prev'])
+
+def search_words(term):
+  return re.findall(r'\w+', term.lower())
+
+class PostgresSearch(object):
+  '''
+  Searches venues and artists with the pg_trgm and full-text GIN indexes
+  created by migration 8b5d2e61f4a3. Substring matches on name, city and
+  state are served by the trigram indexes, and results are ranked by
+  full-text rank plus trigram similarity to the name. Pages are keyset
+  paged on (rank, id), and only the first one counts the matches. Terms
+  shorter than a trigram are looked up as prefixes in the typeahead index.
+  '''
+  REGCONFIG = literal_column("'simple'::regconfig")
+
+  def document(self, model):
+    # Must stay identical to the expression indexed by the migration
+    empty, space = literal_column("''"), literal_column("' '")
+    return func.to_tsvector(self.REGCONFIG,
+      func.coalesce(model.name, empty).concat(space)
+        .concat(func.coalesce(model.city, empty)).concat(space)
+        .concat(func.coalesce(model.state, empty)))
+
+  def search(self, model, term, secondary_term, after=None, before=None, per_page=SEARCH_PAGE_SIZE):
+    if 0 < len(term.strip()) < SEARCH_MIN_SUBSTRING:
+      return self.prefix_search(model, term, secondary_term, after, before, per_page)
+    conditions = [
+      model.name.ilike(f'%{term}%'),
+      model.city.ilike(f'%{term}%'),
+      model.state.ilike(f'%{term}%'),
+      model.state.ilike(f'%{secondary_term}%'),
+    ]
+    rank = func.similarity(model.name, term)
+    words = search_words(term)
+    if words:
+      tsquery = func.to_tsquery(self.REGCONFIG, ' & '.join(w + ':*' for w in words))
+      document = self.document(model)
+      conditions.append(document.op('@@')(tsquery))
+      rank = rank + func.ts_rank(document, tsquery)
+    # Best rank first; double precision so the cursor round-trips exactly
+    sort_rank = cast(-rank, db.Float(precision=53))
+    query = (db.session.query(model.id, model.name, model.city, model.state, sort_rank.label('sort_rank'))
+      .filter(or_(*conditions), model.deleted_ts.is_(None)))
+    first_page = after is None and before is None
+    if first_page:
+      # Counted in the same pass as the ranking sort
+      query = query.add_columns(func.count().over().label('total'))
+    page = keyset_page(query, (sort_rank, model.id), lambda r: (r.sort_rank, r.id),
+      after=after, before=before, per_page=per_page)
+    total = None
+    if first_page:
+      total = page.items[0].total if page.items else 0
+    items = [{"id": r.id, "name": r.name, "city": r.city, "state": r.state} for r in page.items]
+    return SearchResult(total, items, page.next, page.prev)
+
+  def prefix_search(self, model, term, secondary_term, after, before, per_page):
+    '''
+    matches names, name words, cities and states starting with term, and
+    states starting with secondary_term, from the typeahead index. Ranked
+    like the typeahead and capped at TYPEAHEAD_SCAN_LIMIT matches a lookup.
+    '''
+    kind = dict(TYPEAHEAD_KINDS)[model]
+    docs = typeahead.lookup(term, TYPEAHEAD_SCAN_LIMIT, kind)
+    if secondary_term != term:
+      state = normalize_typeahead(secondary_term)
+      seen = {doc["id"] for doc in docs}
+      docs += [doc for doc in typeahead.lookup(secondary_term, TYPEAHEAD_SCAN_LIMIT, kind)
+        if doc["id"] not in seen and normalize_typeahead(doc["state"]).startswith(state)]
+    page = list_page(docs, after, before, per_page)
+    return SearchResult(len(docs), page.items, page.next, page.prev)
+
+  def invalidate(self, model):
+    pass
+
+class InvertedIndex(LazyCache):
+  '''
+  In-process n-gram index over the name, city and state of one model, used
+  where the database has no trigram or full-text support (e.g. SQLite).
+  Every 1-, 2- and 3-character gram of each field maps to the ids that
+  contain it, so a substring lookup is a postings intersection followed by
+  a check of the few candidates left.
+  '''
+  FIELDS = ('name', 'city', 'state')
+  GRAM = 3
+
+  def __init__(self, model):
+    super(InvertedIndex, self).__init__()
+    self.model = model
+
+  def _build(self):
+    model = self.model
+    docs = {}
+    postings = {field: {} for field in self.FIELDS}
+    for row in db.session.query(model.id, model.name, model.city, model.state).filter(model.deleted_ts.is_(None)):
+      docs[row.id] = row._asdict()
+      for field in self.FIELDS:
+        value = (getattr(row, field) or '').lower()
+        for n in range(1, self.GRAM + 1):
+          for i in range(len(value) - n + 1):
+            postings[field].setdefault(value[i:i + n], set()).add(row.id)
+    return (docs, postings), datetime.now() + timedelta(seconds=SEARCH_REFRESH_SECONDS)
+
+  def lookup(self, field, fragment):
+    '''
+    returns the ids whose field contains fragment, case-insensitively
+    '''
+    docs, postings = self.get()
+    fragment = fragment.lower()
+    if not fragment:
+      return set(docs)
+    if len(fragment) <= self.GRAM:
+      return set(postings[field].get(fragment, ()))
+    grams = [fragment[i:i + self.GRAM] for i in range(len(fragment) - self.GRAM + 1)]
+    grams.sort(key=lambda g: len(postings[field].get(g, ())))
+    candidates = set(postings[field].get(grams[0], ()))
+    for gram in grams[1:]:
+      if not candidates:
+        break
+      candidates &= postings[field].get(gram, set())
+    return {i for i in candidates if fragment in (docs[i][field] or '').lower()}
+
+  def score(self, doc, term):
+    term = term.lower()
+    best = 0
+    for field, weight in (('name', 1.0), ('city', 0.5), ('state', 0.5)):
+      value = (doc[field] or '').lower()
+      if not term or term not in value:
+        continue
+      if value == term:
+        quality = 3
+      elif value.startswith(term):
+        quality = 2
+      elif any(w.startswith(term) for w in value.split()):
+        quality = 1.5
+      else:
+        quality = 1
+      best = max(best, weight * quality)
+    return best
+
+  def search(self, term, secondary_term, after=None, before=None, per_page=SEARCH_PAGE_SIZE):
+    docs, _ = self.get()
+    ids = set()
+    for field in self.FIELDS:
+      ids |= self.lookup(field, term)
+    ids |= self.lookup('state', secondary_term)
+    ranked = sorted(
+      (docs[i] for i in ids),
+      key=lambda d: (-self.score(d, term), d['name'], d['id'])
+    )
+    page = list_page(ranked, after, before, per_page)
+    return SearchResult(len(ranked), page.items, page.next, page.prev)
+
+class InMemorySearch(object):
+  '''
+  Same interface as PostgresSearch, backed by one InvertedIndex per model.
+  '''
+  def __init__(self):
+    self._indexes = {}
+    self._lock = threading.Lock()
+
+  def index(self, model):
+    with self._lock:
+      if model not in self._indexes:
+        self._indexes[model] = InvertedIndex(model)
+      return self._indexes[model]
+
+  def search(self, model, term, secondary_term, after=None, before=None, per_page=SEARCH_PAGE_SIZE):
+    return self.index(model).search(term, secondary_term, after, before, per_page)
+
+  def invalidate(self, model):
+    self.index(model).invalidate()
+
+class SearchBackend(object):
+  '''
+  Picks PostgresSearch or InMemorySearch for the configured database on
+  first use.
+  '''
+  def __init__(self):
+    self._backend = None
+
+  @property
+  def backend(self):
+    if self._backend is None:
+      if db.engine.dialect.name == 'postgresql':
+        self._backend = PostgresSearch()
+      else:
+        self._backend = InMemorySearch()
+    return self._backend
+
+  def search(self, *args, **kwargs):
+    return self.backend.search(*args, **kwargs)
+
+  def invalidate(self, model):
+    self.backend.invalidate(model)
+
+search_backend = SearchBackend()
+
+def parse_search_terms():
+  '''
+  returns (search_term, secondary_search_term, after, before) from the
+  search form. "term,state" also matches venues or artists in the given
+  state. after and before are the pager's cursors.
+  '''
+  search_terms = request.form.get('search_term', '').split(',')
+  search_term = search_terms[0]
+  if len(search_terms) > 1:
+    secondary_search_term = search_terms[1]
+  else:
+    secondary_search_term = search_term
+  return search_term, secondary_search_term, request.form.get('after'), request.form.get('before')
+
+def search_count(results):
+  '''
+  returns the number of matches, carried over from the first page by the
+  pager when the backend did not count them again
+  '''
+  if results.total is not None:
+    return results.total
+  return request.form.get('count', 0, type=int)
+
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 50
+# Prefix matches looked at per query; bounds the work for one-letter queries
+TYPEAHEAD_SCAN_LIMIT = 200
+# Other worker processes do not see this one's updates, so reseed now and then
+TYPEAHEAD_REFRESH_SECONDS = 300
+# (model, kind) pairs the typeahead covers; kind is also the url prefix
+TYPEAHEAD_KINDS = ((Venue, 'venues'), (Artist, 'artists'))
+
+def normalize_typeahead(text):
+  '''
+  lowercases text, strips accents and collapses whitespace
+  '''
+  text = unicodedata.normalize('NFKD', text or '')
+  text = ''.join(c for c in text if not unicodedata.combining(c))
+  return ' '.join(text.casefold().split())
+
+class TypeaheadIndex(LazyCache):
+  '''
+  Sorted arrays of normalized venue and artist names, cities and states for
+  as-you-type prefix lookups, one array per kind of match. Every word-start
+  suffix of a name is a key, so "hop" finds "The Musical Hop". A lookup is
+  a bisect plus a short scan per array; put() and discard() keep the arrays
+  current without a rebuild.
+  '''
+  # Rank of a match by where the prefix matched, best first; also the
+  # position of its array in the index
+  NAME, NAME_WORD, CITY, STATE = range(4)
+  RANKS = (NAME, NAME_WORD, CITY, STATE)
+
+  def _build(self):
+    keyed = {rank: [] for rank in self.RANKS}
+    by_entity = {}
+    for model, kind in TYPEAHEAD_KINDS:
+      for row in db.session.query(model.id, model.name, model.city, model.state).filter(model.deleted_ts.is_(None)):
+        doc = {"type": kind, "id": row.id, "name": row.name, "city": row.city, "state": row.state}
+        keys = self._keys(row.name, row.city, row.state)
+        by_entity[(kind, row.id)] = keys
+        for key, rank in keys:
+          keyed[rank].append((key, doc))
+    # One sort per array; inserting key by key would be quadratic
+    buckets = []
+    for rank in self.RANKS:
+      keyed[rank].sort(key=lambda entry: entry[0])
+      buckets.append(([key for key, _ in keyed[rank]], [doc for _, doc in keyed[rank]]))
+    return (buckets, by_entity), datetime.now() + timedelta(seconds=TYPEAHEAD_REFRESH_SECONDS)
+
+  def _keys(self, name, city, state):
+    words = normalize_typeahead(name).split(' ')
+    keys = [(' '.join(words), self.NAME)]
+    keys += [(' '.join(words[i:]), self.NAME_WORD) for i in range(1, len(words))]
+    keys += [(normalize_typeahead(city), self.CITY), (normalize_typeahead(state), self.STATE)]
+    return [key for key in keys if key[0]]
+
+  def _insert(self, index, kind, id, name, city, state):
+    buckets, by_entity = index
+    doc = {"type": kind, "id": id, "name": name, "city": city, "state": state}
+    by_entity[(kind, id)] = self._keys(name, city, state)
+    for key, rank in by_entity[(kind, id)]:
+      keys, docs = buckets[rank]
+      position = bisect.bisect_right(keys, key)
+      keys.insert(position, key)
+      docs.insert(position, doc)
+
+  def _remove(self, index, kind, id):
+    buckets, by_entity = index
+    for key, rank in by_entity.pop((kind, id), ()):
+      keys, docs = buckets[rank]
+      position = bisect.bisect_left(keys, key)
+      while docs[position]["type"] != kind or docs[position]["id"] != id:
+        position += 1
+      del keys[position]
+      del docs[position]
+
+  def put(self, kind, id, name, city, state):
+    '''
+    adds or replaces one venue or artist
+    '''
+    with self._lock:
+      if self._note_write():
+        return
+      self._remove(self._value, kind, id)
+      self._insert(self._value, kind, id, name, city, state)
+
+  def discard(self, kind, id):
+    with self._lock:
+      if self._note_write():
+        return
+      self._remove(self._value, kind, id)
+
+  def lookup(self, query, limit=TYPEAHEAD_LIMIT, kind=None):
+    '''
+    returns up to limit venues and/or artists with a name, name word, city
+    or state starting with query. Name matches rank first, then names.
+    '''
+    query = normalize_typeahead(query)
+    if not query:
+      return []
+    buckets, _ = self.get()
+    results, seen = [], set()
+    for rank in self.RANKS:
+      # Each array is scanned on its own, so many city or state matches
+      # cannot crowd out name matches
+      with self._lock:
+        keys, docs = buckets[rank]
+        position = bisect.bisect_left(keys, query)
+        matches = []
+        while position < len(keys) and len(matches) < TYPEAHEAD_SCAN_LIMIT and keys[position].startswith(query):
+          doc = docs[position]
+          if kind is None or doc["type"] == kind:
+            matches.append(doc)
+          position += 1
+      matches.sort(key=lambda doc: (doc["name"], doc["id"]))
+      for doc in matches:
+        if (doc["type"], doc["id"]) not in seen:
+          seen.add((doc["type"], doc["id"]))
+          results.append(dict(doc))
+          if len(results) == limit:
+            return results
+    return results
+
+typeahead = TypeaheadIndex()
+
+#----------------------------------------------------------------------------#
+# Bookings.
+#----------------------------------------------------------------------------#
+
+# Postgres exclusion constraints that reject overlapping shows
+BOOKING_CONSTRAINTS = {
+  'ex_shows_artist_id_during': 'The artist is already booked at that time.',
+  'ex_shows_venue_id_during': 'The venue is already booked at that time.',
+}
+
+class BookingConflict(Exception):
+  pass
+
+class BookingIntervals(LazyCache):
+  '''
+  In-process index of show intervals per artist and per venue, for
+  databases without exclusion constraints (e.g. SQLite). Each key keeps
+  its intervals sorted by start, plus the longest duration seen, so an
+  overlap check only looks at intervals starting in
+  [start - longest duration, end).
+  '''
+  def _build(self):
+    index = {}
+    for show in db.session.query(Show.artist_id, Show.venue_id, Show.start_time, Show.duration):
+      end_time = show.start_time + timedelta(minutes=show.duration)
+      self._insert(index, ('artist', show.artist_id), show.start_time, end_time)
+      self._insert(index, ('venue', show.venue_id), show.start_time, end_time)
+    return index, None
+
+  def _insert(self, index, key, start_time, end_time):
+    intervals, longest = index.get(key, ([], timedelta(0)))
+    bisect.insort(intervals, (start_time, end_time))
+    index[key] = (intervals, max(longest, end_time - start_time))
+
+  def overlaps(self, key, start_time, end_time):
+    intervals, longest = self.get().get(key, ([], timedelta(0)))
+    lo = bisect.bisect_left(intervals, (start_time - longest,))
+    hi = bisect.bisect_left(intervals, (end_time,))
+    return any(s < end_time and start_time < e for s, e in intervals[lo:hi])
+
+  def add(self, key, start_time, end_time):
+    index = self.get()
+    with self._lock:
+      self._insert(index, key, start_time, end_time)
+
+booking_intervals = BookingIntervals()
+# Serialises check-and-insert where the database cannot do it for us
+booking_lock = threading.Lock()
+
+def check_listed(show):
+  '''
+  raises BookingConflict unless the show's artist and venue exist and are
+  not deleted. On Postgres both rows stay locked until the show commits,
+  so they cannot be deleted (and purged without counting this show) in
+  between. The lock is FOR NO KEY UPDATE rather than FOR SHARE, because
+  the show's counter update writes these rows later in the transaction;
+  upgrading a share lock there would deadlock with a concurrent booking.
+  Artist before venue, like update_show_counters().
+  '''
+  for model, id, kind in ((Artist, show.artist_id, 'artist'), (Venue, show.venue_id, 'venue')):
+    listed = (db.session.query(model.id)
+      .filter(model.id==id, model.deleted_ts.is_(None))
+      .with_for_update(key_share=True)
+      .first()
+    )
+    if listed is None:
+      raise BookingConflict(f'The {kind} does not exist.')
+
+def add_show(show, before_commit=None):
+  '''
+  adds and commits a show, raising BookingConflict if its artist or venue
+  is deleted or already has a show overlapping it. On Postgres the
+  exclusion constraints decide atomically; elsewhere the check runs
+  against BookingIntervals under a lock. before_commit() runs in the same
+  transaction.
+  '''
+  if db.engine.dialect.name == 'postgresql':
+    try:
+      check_listed(show)
+      db.session.add(show)
+      if before_commit is not None:
+        before_commit()
+      db.session.commit()
+    except IntegrityError as e:
+      constraint = getattr(getattr(e.orig, 'diag', None), 'constraint_name', None)
+      if constraint in BOOKING_CONSTRAINTS:
+        raise BookingConflict(BOOKING_CONSTRAINTS[constraint])
+      raise
+    return
+  with booking_lock:
+    check_listed(show)
+    start_time, end_time = show.start_time, show.end_time
+    if booking_intervals.overlaps(('artist', show.artist_id), start_time, end_time):
+      raise BookingConflict(BOOKING_CONSTRAINTS['ex_shows_artist_id_during'])
+    if booking_intervals.overlaps(('venue', show.venue_id), start_time, end_time):
+      raise BookingConflict(BOOKING_CONSTRAINTS['ex_shows_venue_id_during'])
+    artist_id, venue_id = show.artist_id, show.venue_id
+    db.session.add(show)
+    if before_commit is not None:
+      before_commit()
+    db.session.commit()
+    booking_intervals.add(('artist', artist_id), start_time, end_time)
+    booking_intervals.add(('venue', venue_id), start_time, end_time)
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 @app.route('/')
+@replica_reads
 def index():
-  recent_artists = Artist.query.order_by(desc(Artist.created_ts)).limit(10).all()
-  recent_venues = Venue.query.order_by(desc(Venue.created_ts)).limit(10).all()
-  return render_template('pages/home.html', recent_artists=recent_artists, recent_venues=recent_venues)
+  return render_template('pages/home.html', recent_artists=recent_artists.get(), recent_venues=recent_venues.get())
 
 
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@replica_reads
 def venues():
   # num_shows should be aggregated based on number of upcoming shows per venue.
-  data = []
-  q = Venue.query
-  areas = q.distinct(Venue.city, Venue.state).options(load_only('city', 'state')).order_by('state','city').all()
-  for area in areas:
-    venues = (
-      q.add_columns(Venue.id, Venue.name, func.count(Show.venue_id).label('num_upcoming_shows'))
-        .join(Show, and_(Venue.id==Show.venue_id, Show.start_time >= func.now()), full=True)
-        .group_by(Venue.id)
-        .filter(Venue.city==area.city, Venue.state==area.state).order_by(Venue.name)
-        .all()
-    )
-    data.append({
-      "city": area.city,
-      "state": area.state,
-      "venues": venues
-    })
-  return render_template('pages/venues.html', areas=data)
+  # ?genre= (repeatable) and ?state= narrow the list; facets count what is left
+  genres = request.args.getlist('genre')
+  state = request.args.get('state') or None
+  selected, genre_counts, state_counts = venue_facets.select(genres, state)
+  areas = area_index.get()
+  if genres or state:
+    areas = [
+      dict(area, venues=[v for v in area['venues'] if v['id'] in selected])
+      for area in areas if not state or area['state'] == state
+    ]
+    areas = [area for area in areas if area['venues']]
+  def filter_url(genres, state):
+    return url_for('venues', genre=sorted(genres), state=state)
+  facets = {
+    "genres": [{
+      "name": genre,
+      "count": count,
+      "active": genre in genres,
+      "url": filter_url(set(genres) ^ {genre}, state)
+    } for genre, count in genre_counts.items()],
+    "states": [{
+      "name": name,
+      "count": count,
+      "active": name == state,
+      "url": filter_url(genres, None if name == state else name)
+    } for name, count in state_counts.items()]
+  }
+  return stream_template('pages/venues.html', areas=areas, facets=facets)
 
 @app.route('/venues/search', methods=['POST'])
+@replica_reads
 def search_venues():
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  search_terms = request.form.get('search_term', '').split(',')
-  search_term = search_terms[0]
-  if len(search_terms) > 1:
-    secondary_search_term = search_terms[1]
-  else:
-    secondary_search_term = search_term
-  results = (Venue.query.filter(or_(
-    Venue.name.ilike(f'%{search_term}%'),
-    Venue.city.ilike(f'%{search_term}%'),
-    Venue.state.ilike(f'%{search_term}%'),
-    Venue.state.ilike(f'%{secondary_search_term}%'),
-    ))
-    .add_columns(Venue.id, Venue.name, Venue.city, Venue.state,func.count(Show.venue_id).label('num_upcoming_shows'))
-    .join(Show, and_(Venue.id==Show.venue_id, Show.start_time >= func.now()), full=True)
-    .group_by(Venue.id).all()
-  )
+  search_term, secondary_search_term, after, before = parse_search_terms()
+  results = search_backend.search(Venue, search_term, secondary_search_term, after, before)
+  upcoming = dict(db.session.query(Venue.id, Venue.upcoming_shows_count)
+    .filter(Venue.id.in_([v['id'] for v in results.items]))
+    .all()
+  ) if results.items else {}
+  for venue in results.items:
+    venue['num_upcoming_shows'] = upcoming.get(venue['id'], 0)
   response={
-    "count": len(results),
-    "data": results
+    "count": search_count(results),
+    "data": results.items,
+    "next": results.next,
+    "prev": results.prev
   }
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
+@replica_reads
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  venue = Venue.query.filter(Venue.id==venue_id).first()
-  if venue is None:
+  def render():
+    venue = Venue.query.filter(Venue.id==venue_id, Venue.deleted_ts.is_(None)).first()
+    if venue is None:
+      return None
+    upcoming_shows, past_shows = partition_shows(
+      show_query('venue_tiles').filter(Show.venue_id==venue_id)
+    )
+    return {
+      "name": venue.name,
+      "html": Markup(render_template('fragments/show_venue.html',
+        venue=venue,
+        upcoming_shows=upcoming_shows,
+        upcoming_shows_count=len(upcoming_shows),
+        past_shows=past_shows,
+        past_shows_count=len(past_shows)
+      ))
+    }
+  updated_ts = (db.session.query(Venue.updated_ts)
+    .filter(Venue.id==venue_id, Venue.deleted_ts.is_(None))
+    .scalar()
+  )
+  if updated_ts is None:
     flash('Venue not found!')
     abort(404)
-  q = Show.query.filter(Show.venue_id==venue_id)
-  upcoming_shows = (q
-    .filter(Show.start_time >= func.now())
-    .all()
-  )
-  past_shows = (q
-    .filter(Show.start_time < func.now())
-    .all()
-  )
-  return render_template('pages/show_venue.html', venue=venue, upcoming_shows=upcoming_shows, past_shows=past_shows)
+  def render_page():
+    fragment = fragment_cache.get_or_render('venue', venue_id, updated_ts, render)
+    if fragment is None:
+      flash('Venue not found!')
+      abort(404)
+    return render_template('pages/show_venue.html', fragment=fragment)
+  return conditional_page('venue', venue_id, updated_ts, render_page)
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -203,11 +1848,14 @@ def create_venue_submission():
     genres = request.form.getlist('genres'),
     website = request.form['website'],
     facebook_link = request.form['facebook_link'],
-    created_ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    created_ts = datetime.now().replace(microsecond=0)
   )
   try:
     db.session.add(venue)
     db.session.commit()
+    venues_changed()
+    recent_venues.push(venue.id, venue.name)
+    typeahead.put('venues', venue.id, venue.name, venue.city, venue.state)
   except:
     error = True
     db.session.rollback()
@@ -227,9 +1875,18 @@ def delete_venue(venue_id):
   resp = {}
   error = False
   try:
+    # Hidden now; purge_deleted() removes the row and its shows later
     venue = Venue.query.get(venue_id)
-    db.session.delete(venue)
+    name = venue.name
+    # Artist pages stop showing this venue's shows. Artists are written
+    # before the venue, in the order bookings lock them
+    touch_pages(Artist, Show.artist_id, Show.venue_id==venue_id)
+    venue.deleted_ts = datetime.utcnow()
     db.session.commit()
+    venues_changed()
+    recent_venues.invalidate()
+    typeahead.discard('venues', venue_id)
+    shows_changed()
   except:
     db.session.rollback()
     error = True
@@ -238,7 +1895,7 @@ def delete_venue(venue_id):
     db.session.close()
     resp['ok'] = not error
   if not error:
-    flash('Venue ' + venue.name + ' was successfully deleted!')
+    flash('Venue ' + name + ' was successfully deleted!')
   else:
     flash('An error occurred. Venue could not be deleted.')
     abort(500)
@@ -247,7 +1904,7 @@ def delete_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   venue = Venue.query.get(venue_id)
-  if venue is None:
+  if venue is None or venue.deleted_ts is not None:
     flash('Venue not found')
     abort(404)
   form = VenueForm(obj=venue)
@@ -256,8 +1913,12 @@ def edit_venue(venue_id):
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   error = False
+  missing = False
   try:
-    Venue.query.filter(Venue.id==venue_id).update({
+    # Artist pages show this venue's name and image on their show tiles.
+    # Artists are written before the venue, in the order bookings lock them
+    touch_pages(Artist, Show.artist_id, Show.venue_id==venue_id)
+    updated = Venue.query.filter(Venue.id==venue_id, Venue.deleted_ts.is_(None)).update({
       'name': request.form['name'],
       'city': request.form['city'],
       'state': request.form['state'],
@@ -265,15 +1926,27 @@ def edit_venue_submission(venue_id):
       'phone': request.form['phone'],
       'genres': request.form.getlist('genres'),
       'website': request.form['website'],
-      'facebook_link': request.form['facebook_link']
+      'facebook_link': request.form['facebook_link'],
+      'updated_ts': datetime.utcnow()
     })
-    db.session.commit()
+    if not updated:
+      # No such venue, or it was deleted
+      missing = True
+      db.session.rollback()
+    else:
+      db.session.commit()
+      venues_changed()
+      recent_venues.invalidate()
+      typeahead.put('venues', venue_id, request.form['name'], request.form['city'], request.form['state'])
   except:
     error = True
     db.session.rollback()
     print(sys.exc_info())
   finally:
     db.session.close()
+  if missing:
+    flash('Venue not found!')
+    abort(404)
   if not error:
     flash('Venue ' + request.form['name'] + ' was successfully edited!')
   else:
@@ -285,57 +1958,88 @@ def edit_venue_submission(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@replica_reads
 def artists():
-  data = Artist.query.all()
-  return render_template('pages/artists.html', artists=data)
+  if request.args.get('all'):
+    # Every artist, streamed as it is read
+    data = (Artist.query.options(load_only('id', 'name'))
+      .filter(Artist.deleted_ts.is_(None))
+      .order_by(Artist.name, Artist.id)
+      .yield_per(STREAM_BATCH_SIZE)
+    )
+    return stream_template('pages/artists.html', artists=data, page=None)
+  page = keyset_page(
+    Artist.query.options(load_only('id', 'name')).filter(Artist.deleted_ts.is_(None)),
+    (Artist.name, Artist.id),
+    lambda a: (a.name, a.id),
+    after=request.args.get('after'),
+    before=request.args.get('before')
+  )
+  if wants_json():
+    return jsonify({
+      "data": [{"id": a.id, "name": a.name} for a in page.items],
+      "next": page.next,
+      "prev": page.prev
+    })
+  return stream_template('pages/artists.html', artists=page.items, page=page)
 
 @app.route('/artists/search', methods=['POST'])
+@replica_reads
 def search_artists():
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  search_terms = request.form.get('search_term', '').split(',')
-  search_term = search_terms[0]
-  if len(search_terms) > 1:
-    secondary_search_term = search_terms[1]
-  else:
-    secondary_search_term = search_term
-  results = (Artist.query.filter(or_(
-    Artist.name.ilike(f'%{search_term}%'),
-    Artist.city.ilike(f'%{search_term}%'),
-    Artist.state.ilike(f'%{search_term}%'),
-    Artist.state.ilike(f'%{secondary_search_term}%'),
-  )).all()
-  )
+  search_term, secondary_search_term, after, before = parse_search_terms()
+  results = search_backend.search(Artist, search_term, secondary_search_term, after, before)
   response={
-    "count": len(results),
-    "data": results
+    "count": search_count(results),
+    "data": results.items,
+    "next": results.next,
+    "prev": results.prev
   }
   return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
+@replica_reads
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  artist = Artist.query.filter(Artist.id==artist_id).first()
-  if artist is None:
+  def render():
+    artist = Artist.query.filter(Artist.id==artist_id, Artist.deleted_ts.is_(None)).first()
+    if artist is None:
+      return None
+    upcoming_shows, past_shows = partition_shows(
+      show_query('artist_tiles').filter(Show.artist_id==artist_id)
+    )
+    return {
+      "name": artist.name,
+      "html": Markup(render_template('fragments/show_artist.html',
+        artist=artist,
+        upcoming_shows=upcoming_shows,
+        upcoming_shows_count=len(upcoming_shows),
+        past_shows=past_shows,
+        past_shows_count=len(past_shows)
+      ))
+    }
+  updated_ts = (db.session.query(Artist.updated_ts)
+    .filter(Artist.id==artist_id, Artist.deleted_ts.is_(None))
+    .scalar()
+  )
+  if updated_ts is None:
     flash('Artist not found!')
     abort(404)
-  q = Show.query.filter(Show.artist_id==artist_id)
-  upcoming_shows = (q
-    .filter(Show.start_time >= func.now())
-    .all()
-  )
-  past_shows = (q
-    .filter(Show.start_time < func.now())
-    .all()
-  )
-  return render_template('pages/show_artist.html', artist=artist, upcoming_shows=upcoming_shows, past_shows=past_shows)
+  def render_page():
+    fragment = fragment_cache.get_or_render('artist', artist_id, updated_ts, render)
+    if fragment is None:
+      flash('Artist not found!')
+      abort(404)
+    return render_template('pages/show_artist.html', fragment=fragment)
+  return conditional_page('artist', artist_id, updated_ts, render_page)
 
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   artist = Artist.query.get(artist_id)
-  if artist is None:
+  if artist is None or artist.deleted_ts is not None:
     flash('Artist not found')
     abort(404)
   form = ArtistForm(obj=artist)
@@ -344,23 +2048,37 @@ def edit_artist(artist_id):
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   error = False
+  missing = False
   try:
-    Artist.query.filter(Artist.id==artist_id).update({
+    updated = Artist.query.filter(Artist.id==artist_id, Artist.deleted_ts.is_(None)).update({
       'name': request.form['name'],
       'city': request.form['city'],
       'state': request.form['state'],
       'phone': request.form['phone'],
       'genres': request.form.getlist('genres'),
       'website': request.form['website'],
-      'facebook_link': request.form['facebook_link']
+      'facebook_link': request.form['facebook_link'],
+      'updated_ts': datetime.utcnow()
     })
-    db.session.commit()
+    if not updated:
+      # No such artist, or it was deleted
+      missing = True
+      db.session.rollback()
+    else:
+      touch_pages(Venue, Show.venue_id, Show.artist_id==artist_id)
+      db.session.commit()
+      artists_changed()
+      recent_artists.invalidate()
+      typeahead.put('artists', artist_id, request.form['name'], request.form['city'], request.form['state'])
   except:
     error = True
     db.session.rollback()
     print(sys.exc_info())
   finally:
     db.session.close()
+  if missing:
+    flash('Artist not found!')
+    abort(404)
   if not error:
     flash('Artist ' + request.form['name'] + ' was successfully edited!')
   else:
@@ -389,12 +2107,15 @@ def create_artist_submission():
     genres = request.form.getlist('genres'),
     website = request.form['website'],
     facebook_link = request.form['facebook_link'],
-    created_ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    created_ts = datetime.now().replace(microsecond=0),
     available_booking_times = []
   )
   try:
     db.session.add(artist)
     db.session.commit()
+    artists_changed()
+    recent_artists.push(artist.id, artist.name)
+    typeahead.put('artists', artist.id, artist.name, artist.city, artist.state)
   except:
     error = True
     db.session.rollback()
@@ -415,8 +2136,14 @@ def delete_artist(artist_id):
   error = False
   try:
     artist = Artist.query.get(artist_id)
-    db.session.delete(artist)
+    name = artist.name
+    artist.deleted_ts = datetime.utcnow()
+    touch_pages(Venue, Show.venue_id, Show.artist_id==artist_id)
     db.session.commit()
+    artists_changed()
+    recent_artists.invalidate()
+    typeahead.discard('artists', artist_id)
+    shows_changed()
   except:
     db.session.rollback()
     error = True
@@ -425,7 +2152,7 @@ def delete_artist(artist_id):
     db.session.close()
     resp['ok'] = not error
   if not error:
-    flash('Artist ' + artist.name + ' was successfully deleted!')
+    flash('Artist ' + name + ' was successfully deleted!')
   else:
     flash('An error occurred. Artist could not be deleted.')
     abort(500)
@@ -436,33 +2163,84 @@ def delete_artist(artist_id):
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@replica_reads
 def shows():
-  # displays list of shows at /shows
-  data = Show.query.all()
-  return render_template('pages/shows.html', shows=data)
+  # displays list of shows at /shows, optionally by ?city=&state=&from=&to=
+  criteria, filters = show_filters(request.args)
+  if request.args.get('all'):
+    # Every show, streamed as it is read
+    data = (show_query('tiles')
+      .filter(*criteria)
+      .order_by(Show.start_time, Show.artist_id, Show.venue_id)
+      .yield_per(STREAM_BATCH_SIZE)
+    )
+    return stream_template('pages/shows.html', shows=data, page=None, filters=filters)
+  page = keyset_page(
+    show_query('tiles').filter(*criteria),
+    (Show.start_time, Show.artist_id, Show.venue_id),
+    lambda s: (s.start_time, s.artist_id, s.venue_id),
+    after=request.args.get('after'),
+    before=request.args.get('before')
+  )
+  if wants_json():
+    return jsonify({
+      "data": [{
+        "venue_id": s.venue_id,
+        "venue_name": s.venue.name,
+        "artist_id": s.artist_id,
+        "artist_name": s.artist.name,
+        "artist_image_link": s.artist.image_link,
+        "start_time": s.start_time.isoformat()
+      } for s in page.items],
+      "next": page.next,
+      "prev": page.prev
+    })
+  return stream_template('pages/shows.html', shows=page.items, page=page, filters=filters)
 
 @app.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
-  artist_ids = [(a.id, a.name) for a in Artist.query.all()]
-  venue_ids = [(v.id, v.name) for v in Venue.query.all()]
+  artist_ids = [(a.id, a.name) for a in Artist.query.filter(Artist.deleted_ts.is_(None))]
+  venue_ids = [(v.id, v.name) for v in Venue.query.filter(Venue.deleted_ts.is_(None))]
   form.artist_id.choices = artist_ids
   form.venue_id.choices = venue_ids
   return render_template('forms/new_show.html', form=form)
 
+def show_submission(form_class):
+  '''
+  builds a Show from a create or book form submission and returns (show,
+  None), or (None, reason) when the submission is not valid. Durations are
+  checked by the forms.py form; start times accept anything dateutil does.
+  '''
+  form = form_class(request.form, meta={'csrf': False})
+  if not form.duration.validate(form):
+    return None, 'Duration: ' + form.duration.errors[0]
+  try:
+    show = Show(
+      artist_id = int(request.form['artist_id']),
+      venue_id = int(request.form['venue_id']),
+      start_time = dateutil.parser.parse(request.form['start_time']),
+      duration = form.duration.data or Show.duration.default.arg
+    )
+  except (KeyError, ValueError, OverflowError):
+    return None, 'Please give an artist, a venue and a valid start time.'
+  return show, None
+
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   error = False
-  show = Show(
-    artist_id = request.form['artist_id'],
-    venue_id = request.form['venue_id'],
-    start_time = request.form['start_time']
-  )
+  show, conflict = show_submission(ShowForm)
+  if conflict:
+    flash('Show could not be listed. ' + conflict)
+    return redirect(url_for('create_shows'))
   try:
-    db.session.add(show)
-    db.session.commit()
+    add_show(show)
+    shows_changed(int(request.form['artist_id']), int(request.form['venue_id']))
+  except BookingConflict as e:
+    conflict = str(e)
+    db.session.rollback()
   except:
     error = True
     db.session.rollback()
@@ -470,6 +2248,9 @@ def create_show_submission():
   finally:
     db.session.close()
   data = show
+  if conflict:
+    flash('Show could not be listed. ' + conflict)
+    return redirect(url_for('create_shows'))
   if not error:
     flash('Show was successfully listed!')
   else:
@@ -477,33 +2258,84 @@ def create_show_submission():
     abort(500)
   return render_template('pages/home.html')
 
+BOOKING_WINDOW_DAYS = 30
+BOOKING_SLOTS_LIMIT = 500
+
+def booking_slots_in_window(args):
+  '''
+  returns (start_time, label) choices for booking slots in the requested
+  window, optionally narrowed to one artist or to artists in a city/state
+  (or in the city of a given venue). Only rows in the window are read,
+  through the (start_time, artist_id) index.
+  '''
+  try:
+    start = dateutil.parser.parse(args['from']) if args.get('from') else datetime.now()
+    end = dateutil.parser.parse(args['to']) if args.get('to') else start + timedelta(days=BOOKING_WINDOW_DAYS)
+  except (ValueError, OverflowError):
+    abort(400)
+  city, state = args.get('city'), args.get('state')
+  venue_id = args.get('venue_id', type=int)
+  if venue_id is not None:
+    venue = (db.session.query(Venue.city, Venue.state)
+      .filter(Venue.id==venue_id, Venue.deleted_ts.is_(None))
+      .first()
+    )
+    if venue is None:
+      abort(404)
+    city, state = venue.city, venue.state
+  q = (db.session.query(BookingSlot.start_time, BookingSlot.label, Artist.id, Artist.name)
+    .join(Artist, Artist.id==BookingSlot.artist_id)
+    .filter(BookingSlot.start_time >= start, BookingSlot.start_time < end, Artist.deleted_ts.is_(None))
+  )
+  artist_id = args.get('artist_id', type=int)
+  if artist_id is not None:
+    q = q.filter(BookingSlot.artist_id==artist_id)
+  if city:
+    q = q.filter(Artist.city==city)
+  if state:
+    q = q.filter(Artist.state==state)
+  return [{
+    "value": slot.start_time.isoformat(),
+    "label": slot.name + ': ' + slot.label,
+    "artist_id": slot.id
+  } for slot in q.order_by(BookingSlot.start_time).limit(BOOKING_SLOTS_LIMIT)]
+
 @app.route('/shows/book')
 def book_shows():
   form = BookForm()
-  artists = Artist.query.all()
-  artist_ids = [(a.id, a.name) for a in artists]
-  venue_ids = [(v.id, v.name) for v in Venue.query.all()]
-  available_booking_times = []
-  for a in artists:
-    for t in a.available_booking_times:
-      available_booking_times.append((t, a.name + ': ' + format_datetime(t)))
+  artist_ids = [(a.id, a.name) for a in Artist.query.options(load_only('id', 'name')).filter(Artist.deleted_ts.is_(None))]
+  venue_ids = [(v.id, v.name) for v in Venue.query.options(load_only('id', 'name')).filter(Venue.deleted_ts.is_(None))]
   form.artist_id.choices = artist_ids
   form.venue_id.choices = venue_ids
-  form.start_time.choices = available_booking_times
+  form.start_time.choices = [(s['value'], s['label']) for s in booking_slots_in_window(request.args)]
   return render_template('forms/new_show.html', type='book', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@app.route('/shows/book/slots')
+def book_show_slots():
+  return jsonify({
+    "slots": booking_slots_in_window(request.args)
+  })
+
+@app.route('/shows/book', methods=['POST'])
 def book_show_submission():
-  # called to create new shows in the db, upon submitting new show listing form
+  # called to create new shows in the db, upon submitting the booking form
   error = False
-  show = Show(
-    artist_id = request.form['artist_id'],
-    venue_id = request.form['venue_id'],
-    start_time = request.form['start_time']
-  )
+  show, conflict = show_submission(BookForm)
+  if conflict:
+    flash('Show could not be booked. ' + conflict)
+    return redirect(url_for('book_shows'))
+  def remove_booked_slot():
+    # The booked slot is no longer available
+    BookingSlot.query.filter(
+      BookingSlot.artist_id==show.artist_id,
+      BookingSlot.start_time==show.start_time
+    ).delete(synchronize_session=False)
   try:
-    db.session.add(show)
-    db.session.commit()
+    add_show(show, before_commit=remove_booked_slot)
+    shows_changed(int(request.form['artist_id']), int(request.form['venue_id']))
+  except BookingConflict as e:
+    conflict = str(e)
+    db.session.rollback()
   except:
     error = True
     db.session.rollback()
@@ -511,6 +2343,9 @@ def book_show_submission():
   finally:
     db.session.close()
   data = show
+  if conflict:
+    flash('Show could not be booked. ' + conflict)
+    return redirect(url_for('book_shows'))
   if not error:
     flash('Show was successfully listed!')
   else:
@@ -519,6 +2354,297 @@ def book_show_submission():
   return render_template('pages/home.html')
 
 
+#  Import
+#  ----------------------------------------------------------------
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_REPORTED_REJECTS = 1000
+
+# (form, model, columns) for each kind of row that can be imported
+IMPORT_KINDS = {
+  'venues': (VenueForm, Venue, ('name', 'city', 'state', 'address', 'phone', 'image_link', 'genres', 'website', 'facebook_link')),
+  'artists': (ArtistForm, Artist, ('name', 'city', 'state', 'phone', 'image_link', 'genres', 'website', 'facebook_link')),
+  'shows': (ShowForm, Show, ('artist_id', 'venue_id', 'start_time', 'duration')),
+}
+
+class ImportReport(object):
+  def __init__(self):
+    self.inserted = 0
+    self.rejected = 0
+    self.rejects = []
+
+  def reject(self, line, errors):
+    self.rejected += 1
+    if len(self.rejects) < IMPORT_MAX_REPORTED_REJECTS:
+      self.rejects.append({"line": line, "errors": errors})
+
+  def format(self):
+    return {
+      "inserted": self.inserted,
+      "rejected": self.rejected,
+      "rejects": self.rejects
+    }
+
+def read_import_rows(stream, format):
+  '''
+  yields (line number, row dict) from a CSV or JSONL text stream, one row
+  at a time. In CSV, genres are comma separated within their cell.
+  '''
+  if format == 'csv':
+    reader = csv.DictReader(stream)
+    for row in reader:
+      if isinstance(row.get('genres'), str):
+        row['genres'] = [g.strip() for g in row['genres'].split(',') if g.strip()]
+      yield reader.line_num, row
+  elif format == 'jsonl':
+    for line_num, line in enumerate(stream, 1):
+      if line.strip():
+        try:
+          yield line_num, json.loads(line)
+        except ValueError as e:
+          yield line_num, e
+  else:
+    raise ValueError(f'Unsupported import format: {format}')
+
+def validate_import_row(kind, row, known_ids):
+  '''
+  validates one row with the forms.py form for its kind and returns
+  (values, errors). Show rows must also point at existing artists and
+  venues, checked against known_ids instead of the forms' choice lists.
+  '''
+  if not isinstance(row, dict):
+    return None, {"row": [str(row)]}
+  form_class, model, columns = IMPORT_KINDS[kind]
+  formdata = MultiDict()
+  for column in columns:
+    value = row.get(column)
+    if isinstance(value, list):
+      formdata.setlist(column, [str(v) for v in value])
+    elif value is not None:
+      formdata.add(column, str(value))
+  form = form_class(formdata=formdata, meta={'csrf': False})
+  if kind == 'shows':
+    form.artist_id.validate_choice = False
+    form.venue_id.validate_choice = False
+  if not form.validate():
+    return None, form.errors
+  values = {column: form[column].data for column in columns}
+  if kind == 'shows':
+    if values['duration'] is None:
+      values['duration'] = Show.duration.default.arg
+    values['counted_upcoming'] = values['start_time'] >= datetime.now()
+    errors = {}
+    for column, ids in (('artist_id', known_ids['artists']), ('venue_id', known_ids['venues'])):
+      try:
+        values[column] = int(values[column])
+      except ValueError:
+        errors[column] = ['Not a valid id.']
+        continue
+      if values[column] not in ids:
+        errors[column] = ['Does not exist.']
+    if errors:
+      return None, errors
+  else:
+    values['created_ts'] = datetime.now().replace(microsecond=0)
+    values['updated_ts'] = datetime.utcnow()
+  if kind == 'artists':
+    values['available_booking_times'] = []
+  return values, None
+
+def copy_rows(table, rows):
+  '''
+  loads rows into table with Postgres COPY, inside the session's transaction
+  '''
+  columns = list(rows[0].keys())
+  buf = io.StringIO()
+  writer = csv.writer(buf)
+  for row in rows:
+    writer.writerow([copy_value(row[c]) for c in columns])
+  buf.seek(0)
+  cursor = db.session.connection().connection.cursor()
+  cursor.copy_expert(
+    f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+    buf
+  )
+
+def copy_value(value):
+  if value is None:
+    return '\\N'
+  if isinstance(value, datetime):
+    return value.isoformat()
+  if isinstance(value, list):
+    return '{' + ','.join('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in value) + '}'
+  return value
+
+def count_imported_shows(rows):
+  # Bulk inserts skip the mapper hooks, so count them here
+  update_show_counters(db.session.execute,
+    [(row['venue_id'], row['artist_id'], row['counted_upcoming']) for row in rows])
+
+def book_imported_show(line, values, report):
+  '''
+  checks an imported show against BookingIntervals, where the database has
+  no exclusion constraints, and returns True if it is free. Free shows are
+  added to the intervals so later rows are checked against them too.
+  '''
+  start_time = values['start_time']
+  end_time = start_time + timedelta(minutes=values['duration'])
+  keys = (
+    (('artist', values['artist_id']), 'ex_shows_artist_id_during'),
+    (('venue', values['venue_id']), 'ex_shows_venue_id_during'),
+  )
+  for key, constraint in keys:
+    if booking_intervals.overlaps(key, start_time, end_time):
+      report.reject(line, {"start_time": [BOOKING_CONSTRAINTS[constraint]]})
+      return False
+  for key, _ in keys:
+    booking_intervals.add(key, start_time, end_time)
+  return True
+
+def insert_batch(model, batch, report):
+  '''
+  inserts a batch of (line, values) like write_batch(). Outside Postgres,
+  shows overlapping an existing or earlier show are rejected first, under
+  the same lock as add_show().
+  '''
+  if model is not Show or db.engine.dialect.name == 'postgresql':
+    write_batch(model, batch, report)
+    return
+  with booking_lock:
+    batch = [(line, values) for line, values in batch if book_imported_show(line, values, report)]
+    if not write_batch(model, batch, report):
+      # Rows already added to the intervals were rejected; reload them
+      booking_intervals.invalidate()
+
+def write_batch(model, batch, report):
+  '''
+  inserts a batch of (line, values) with one COPY (Postgres) or one
+  executemany. If the batch fails, it is retried row by row so only the
+  offending rows are rejected. Returns False if any row was rejected.
+  '''
+  if not batch:
+    return True
+  rows = [values for _, values in batch]
+  try:
+    if db.engine.dialect.name == 'postgresql':
+      copy_rows(model.__table__, rows)
+    else:
+      db.session.execute(model.__table__.insert(), rows)
+    if model is Show:
+      count_imported_shows(rows)
+    db.session.commit()
+    report.inserted += len(rows)
+    return True
+  except Exception:
+    db.session.rollback()
+  complete = True
+  for line, values in batch:
+    try:
+      db.session.execute(model.__table__.insert(), [values])
+      if model is Show:
+        count_imported_shows([values])
+      db.session.commit()
+      report.inserted += 1
+    except Exception as e:
+      db.session.rollback()
+      report.reject(line, {"row": [str(getattr(e, 'orig', e))]})
+      complete = False
+  return complete
+
+def import_rows(kind, stream, format, batch_size=IMPORT_BATCH_SIZE):
+  '''
+  streams rows of the given kind from a CSV or JSONL stream into the
+  database in batches, and returns an ImportReport
+  '''
+  _, model, _ = IMPORT_KINDS[kind]
+  known_ids = {}
+  if kind == 'shows':
+    known_ids['artists'] = {id for id, in db.session.query(Artist.id).filter(Artist.deleted_ts.is_(None))}
+    known_ids['venues'] = {id for id, in db.session.query(Venue.id).filter(Venue.deleted_ts.is_(None))}
+  report = ImportReport()
+  batch = []
+  for line, row in read_import_rows(stream, format):
+    values, errors = validate_import_row(kind, row, known_ids)
+    if errors:
+      report.reject(line, errors)
+      continue
+    batch.append((line, values))
+    if len(batch) >= batch_size:
+      insert_batch(model, batch, report)
+      batch = []
+  if batch:
+    insert_batch(model, batch, report)
+  if report.inserted:
+    if kind == 'venues':
+      venues_changed()
+      recent_venues.invalidate()
+      typeahead.invalidate()
+    elif kind == 'artists':
+      artists_changed()
+      recent_artists.invalidate()
+      typeahead.invalidate()
+    else:
+      shows_changed()
+  return report
+
+@app.route('/import/<kind>', methods=['POST'])
+def import_submission(kind):
+  # streams a CSV (text/csv) or JSONL body of venues, artists or shows
+  if kind not in IMPORT_KINDS:
+    abort(404)
+  format = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+  if format not in ('csv', 'jsonl'):
+    abort(400)
+  stream = io.TextIOWrapper(request.stream, encoding=request.charset or 'utf-8', newline='')
+  report = import_rows(kind, stream, format, request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int))
+  return jsonify(report.format())
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_KINDS)))
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'format', type=click.Choice(['csv', 'jsonl']), default=None,
+  help='Input format. Defaults to the file extension.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+def import_command(kind, source, format, batch_size):
+  '''Bulk import venues, artists or shows from a CSV or JSONL file.'''
+  if format is None:
+    format = 'csv' if source.name.endswith('.csv') else 'jsonl'
+  report = import_rows(kind, source, format, batch_size)
+  for reject in report.rejects:
+    click.echo(json.dumps(reject), err=True)
+  click.echo(f'{report.inserted} {kind} imported, {report.rejected} rejected')
+
+
+#  Typeahead
+#  ----------------------------------------------------------------
+
+@app.route('/api/typeahead')
+def typeahead_api():
+  # as-you-type suggestions; ?type=venues or ?type=artists narrows them
+  kind = request.args.get('type')
+  if kind is not None and kind not in [k for _, k in TYPEAHEAD_KINDS]:
+    abort(400)
+  limit = min(max(request.args.get('limit', TYPEAHEAD_LIMIT, type=int), 1), TYPEAHEAD_MAX_LIMIT)
+  results = typeahead.lookup(request.args.get('q', ''), limit, kind)
+  for result in results:
+    result["url"] = '/%s/%d' % (result["type"], result["id"])
+  return jsonify({
+    "results": results
+  })
+
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/_metrics/pool')
+def pool_metrics_endpoint():
+  return jsonify({bind: metrics.format() for bind, metrics in pool_metrics.items()})
+
+@app.route('/_metrics')
+def metrics():
+  return Response(request_metrics.format(), mimetype='text/plain; version=0.0.4')
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -0,0 +1,43 @@
+"""empty message
+
+Revision ID: 8b5d2e61f4a3
+Revises: 3e8a1f0c9b27
+Create Date: 2026-10-18 10:03:27.551902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5d2e61f4a3'
+down_revision = '3e8a1f0c9b27'
+branch_labels = None
+depends_on = None
+
+# Must stay identical to PostgresSearch.document() in app.py
+SEARCH_DOCUMENT = (
+    "to_tsvector('simple'::regconfig, "
+    "coalesce(name, '') || ' ' || coalesce(city, '') || ' ' || coalesce(state, ''))"
+)
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('venues', 'artists'):
+        op.execute(
+            f'CREATE INDEX ix_{table}_search_document ON {table} '
+            f'USING gin ({SEARCH_DOCUMENT})'
+        )
+        for column in ('name', 'city', 'state'):
+            op.execute(
+                f'CREATE INDEX ix_{table}_{column}_trgm ON {table} '
+                f'USING gin ({column} gin_trgm_ops)'
+            )
+
+
+def downgrade():
+    for table in ('venues', 'artists'):
+        for column in ('name', 'city', 'state'):
+            op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
+        op.drop_index(f'ix_{table}_search_document', table_name=table)
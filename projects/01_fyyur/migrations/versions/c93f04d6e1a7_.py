@@ -0,0 +1,66 @@
+"""empty message
+
+Revision ID: c93f04d6e1a7
+Revises: b7e2f5a09c14
+Create Date: 2026-10-18 14:08:31.774590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c93f04d6e1a7'
+down_revision = 'b7e2f5a09c14'
+branch_labels = None
+depends_on = None
+
+# The time a show occupies its artist and its venue
+SHOW_DURING = "tsrange(start_time, start_time + duration * interval '1 minute')"
+
+# Existing shows get the default duration, so pairs overlapping under it
+# would make the constraints fail to build
+OVERLAPPING_SHOWS = """
+    SELECT '{column}', a.{column}, a.id, b.id
+    FROM shows a JOIN shows b ON a.{column} = b.{column} AND a.id < b.id
+    WHERE tsrange(a.start_time, a.start_time + interval '120 minutes')
+       && tsrange(b.start_time, b.start_time + interval '120 minutes')
+"""
+
+
+def overlapping_shows():
+    bind = op.get_bind()
+    query = ' UNION ALL '.join(
+        OVERLAPPING_SHOWS.format(column=column)
+        for column in ('artist_id', 'venue_id')
+    )
+    return bind.execute(sa.text(query + ' ORDER BY 1, 2, 3, 4')).fetchall()
+
+
+def upgrade():
+    overlaps = overlapping_shows()
+    if overlaps:
+        raise RuntimeError(
+            'Shows overlap under the default 120 minute duration; move or '
+            'delete one show of each pair and run the upgrade '
+            'again:\n' + '\n'.join(
+                f'  {column[:-3]} {owner}: shows {first} and {second}'
+                for column, owner, first, second in overlaps
+            )
+        )
+    op.add_column('shows', sa.Column('duration', sa.Integer(), server_default='120', nullable=False))
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.execute(
+        'ALTER TABLE shows ADD CONSTRAINT ex_shows_artist_id_during '
+        f'EXCLUDE USING gist (artist_id WITH =, {SHOW_DURING} WITH &&)'
+    )
+    op.execute(
+        'ALTER TABLE shows ADD CONSTRAINT ex_shows_venue_id_during '
+        f'EXCLUDE USING gist (venue_id WITH =, {SHOW_DURING} WITH &&)'
+    )
+
+
+def downgrade():
+    op.drop_constraint('ex_shows_venue_id_during', 'shows')
+    op.drop_constraint('ex_shows_artist_id_during', 'shows')
+    op.drop_column('shows', 'duration')
@@ -2,3 +2,27 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Fill a search box's datalist with /api/typeahead suggestions as the user types
+document.querySelectorAll('input[data-typeahead]').forEach(function (input) {
+  var list = document.getElementById(input.getAttribute('list'));
+  var pending = null;
+  input.addEventListener('input', function () {
+    var q = input.value.trim();
+    if (pending) pending.abort();
+    if (!q) return;
+    pending = new AbortController();
+    fetch('/api/typeahead?type=' + input.dataset.typeahead + '&q=' + encodeURIComponent(q), { signal: pending.signal })
+      .then(function (response) { return response.json(); })
+      .then(function (data) {
+        list.innerHTML = '';
+        data.results.forEach(function (result) {
+          var option = document.createElement('option');
+          option.value = result.name;
+          option.label = result.city + ', ' + result.state;
+          list.appendChild(option);
+        });
+      })
+      .catch(function () {});
+  });
+});
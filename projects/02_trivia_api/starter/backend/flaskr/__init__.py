@@ -3,9 +3,12 @@ import sys
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS, cross_origin
-import random
 
-from models import setup_db, Question, Category, format_list, db
+from models import (
+    setup_db, Question, Category, format_list, db, pool_metrics,
+    question_pool, quiz_sessions, category_cache, question_count,
+    question_search
+)
 
 QUESTIONS_PER_PAGE = 10
 
@@ -41,11 +44,11 @@ def create_app(test_config=None):
     @app.route('/categories', methods=["GET"])
     @cross_origin()
     def get_categories():
-        categories = Category.query.all()
-        result = ({
-            "categories": {c.id: c.type for c in categories}
-        })
-        return jsonify(result)
+        # Served from the cached body; unchanged categories answer 304
+        _, _, body, etag = category_cache.load()
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response.make_conditional(request)
 
     '''
     @TODO:
@@ -63,17 +66,31 @@ def create_app(test_config=None):
     @app.route('/questions', methods=["GET"])
     @cross_origin()
     def get_questions_paginated():
+        # Pages after a cursor seek on the id index instead of an OFFSET
+        cursor = request.args.get('cursor', type=int)
         page = request.args.get('page', 1, type=int)
-        question_query = Question.query.paginate(page, QUESTIONS_PER_PAGE)
-        questions_list = format_list(question_query.items)
-
-        categories = Category.query.all()
+        question_query = Question.query.order_by(Question.id)
+        if cursor is not None:
+            question_query = question_query.filter(Question.id > cursor)
+        elif page < 1:
+            abort(404)
+        else:
+            question_query = question_query.offset(
+                (page - 1) * QUESTIONS_PER_PAGE
+            )
+        # One extra row tells whether there is a next page without a COUNT
+        questions = question_query.limit(QUESTIONS_PER_PAGE + 1).all()
+        if not questions and cursor is None and page > 1:
+            abort(404)
+        has_next = len(questions) > QUESTIONS_PER_PAGE
+        questions = questions[:QUESTIONS_PER_PAGE]
 
         result = {
-            "questions": questions_list,
-            "total_questions": question_query.total,
+            "questions": format_list(questions),
+            "total_questions": question_count.get(),
+            "next_cursor": questions[-1].id if has_next else None,
             "current_category": "",
-            "categories": {c.id: c.type for c in categories}
+            "categories": category_cache.categories
         }
 
         return jsonify(result)
@@ -157,15 +174,16 @@ def create_app(test_config=None):
     def search_questions():
         payload = request.get_json()
         search_term = payload.get("searchTerm")
-        if search_term is None:
+        page = payload.get("page", 1)
+        if search_term is None or not isinstance(page, int) or page < 1:
             abort(400)
-        search_results = format_list(Question.query.filter(
-            Question.question.ilike(f'%{search_term}%')).all()
+        search_result = question_search.search(
+            search_term, page, QUESTIONS_PER_PAGE
         )
 
         result = {
-            "questions": search_results,
-            "total_questions": Question.query.count(),
+            "questions": format_list(search_result.questions),
+            "total_questions": search_result.total,
             "current_category": ""
         }
 
@@ -189,7 +207,7 @@ def create_app(test_config=None):
 
         result = {
             "questions": questions,
-            "total_questions": Question.query.count(),
+            "total_questions": question_count.get(),
             "current_category": category_id
         }
 
@@ -216,27 +234,22 @@ def create_app(test_config=None):
         except Exception:
             abort(400)
 
-        # Handle category 'ALL'
-        if quiz_category == '0':
-            questions_in_category = Question.query.all()
-        else:
-            questions_in_category = Question.query.filter_by(
-                category=quiz_category
-            ).all()
-
-        # Handle instance where at first there are no previous questions
-        if len(previous_questions) == 0:
-            questions_not_asked = questions_in_category
-        else:
-            questions_not_asked = ([
-                q for q in questions_in_category
-                if q.id not in previous_questions
-            ])
+        # Category '0' is 'ALL'; the pool samples ids without loading rows
+        asked = set(previous_questions or ())
+        question = None
+        for _ in range(2):
+            question_id = question_pool.sample(quiz_category, asked)
+            if question_id is None:
+                break
+            question = Question.query.get(question_id)
+            if question is not None:
+                break
+            # Deleted by another worker since the pool was loaded
+            question_pool.invalidate(quiz_category)
 
         # Handle instance where there are no unasked questions
-        if len(questions_not_asked) > 0:
-            random_index = random.randint(0, len(questions_not_asked)-1)
-            next_quiz_question = questions_not_asked[random_index].format()
+        if question is not None:
+            next_quiz_question = question.format()
         else:
             next_quiz_question = None
 
@@ -246,6 +259,61 @@ def create_app(test_config=None):
 
         return jsonify(result)
 
+    @app.route('/quizzes/sessions', methods=["POST"])
+    @cross_origin()
+    def create_quiz_session():
+        payload = request.get_json()
+        try:
+            quiz_category = str(payload.get("quiz_category")["id"])
+        except Exception:
+            abort(400)
+
+        token, total_questions = quiz_sessions.create(quiz_category)
+
+        result = {
+            "success": True,
+            "session": token,
+            "total_questions": total_questions
+        }
+
+        return jsonify(result)
+
+    @app.route('/quizzes/sessions/<string:token>/next', methods=["POST"])
+    @cross_origin()
+    def get_next_session_question(token):
+        question = None
+        try:
+            # Skip questions deleted since the session was created
+            while question is None:
+                question_id = quiz_sessions.advance(token)
+                if question_id is None:
+                    break
+                question = Question.query.get(question_id)
+            remaining = quiz_sessions.remaining(token)
+        except KeyError:
+            abort(404)
+
+        result = {
+            "question": question.format() if question else None,
+            "remaining_questions": remaining
+        }
+
+        return jsonify(result)
+
+    @app.route('/quizzes/sessions/<string:token>', methods=["DELETE"])
+    @cross_origin()
+    def end_quiz_session(token):
+        if not quiz_sessions.end(token):
+            abort(404)
+
+        return jsonify({
+            "success": True
+        })
+
+    @app.route('/_metrics/pool', methods=["GET"])
+    def get_pool_metrics():
+        return jsonify(pool_metrics.format())
+
     '''
     @TODO:
     Create error handlers for all expected errors
@@ -0,0 +1,33 @@
+"""empty message
+
+Revision ID: 7c2e9a4d1f60
+Revises: 49b59c239c01
+Create Date: 2026-10-18 21:14:36.207914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e9a4d1f60'
+down_revision = '49b59c239c01'
+branch_labels = None
+depends_on = None
+
+# Must stay identical to PostgresQuestionSearch.document() in models.py
+SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('simple'::regconfig, coalesce(question, '')), 'A') || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(answer, '')), 'B')"
+)
+
+
+def upgrade():
+    op.execute(
+        'CREATE INDEX ix_questions_search_document ON questions '
+        f'USING gin (({SEARCH_DOCUMENT}))'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_questions_search_document', table_name='questions')
@@ -1,5 +1,17 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import re
+import time
+import random
+import bisect
+import secrets
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from sqlalchemy import (
+    Column, String, Integer, create_engine, event, func, select, desc,
+    literal_column
+)
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
 import json
 from flask_migrate import Migrate
@@ -20,15 +32,554 @@ def format_list(list):
     return new_list
 
 
+class InstrumentedQueuePool(QueuePool):
+    '''
+    QueuePool that records how long each checkout waited for a connection
+    '''
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - started)
+
+
+class PoolMetrics(object):
+    '''
+    checkout counts, checkout wait and connection age for the engine's pool
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._opened = {}
+        self.engine = None
+        self.connects = 0
+        self.checkouts = 0
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def instrument(self, engine):
+        if engine is self.engine:
+            return
+        # Listening on the engine keeps the hooks across pool re-creation
+        self.engine = engine
+
+        @event.listens_for(engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            with self._lock:
+                self.connects += 1
+                self._opened[id(connection_record)] = time.time()
+
+        @event.listens_for(engine, 'close')
+        def on_close(dbapi_connection, connection_record):
+            with self._lock:
+                self._opened.pop(id(connection_record), None)
+
+        @event.listens_for(engine, 'checkout')
+        def on_checkout(dbapi_connection, connection_record, proxy):
+            with self._lock:
+                self.checkouts += 1
+
+    def format(self):
+        now = time.time()
+        with self._lock:
+            ages = [now - opened for opened in self._opened.values()]
+            metrics = {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'wait_count': self.wait_count,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+                'connections_open': len(ages),
+                'connection_age_seconds_max': max(ages) if ages else 0.0,
+                'connection_age_seconds_avg': (
+                    sum(ages) / len(ages) if ages else 0.0
+                ),
+            }
+        pool = self.engine.pool if self.engine is not None else None
+        if isinstance(pool, QueuePool):
+            metrics.update({
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+                'max_overflow': pool._max_overflow,
+            })
+        return metrics
+
+
+pool_metrics = PoolMetrics()
+
+
+def engine_options(database_path, environ=os.environ):
+    '''
+    returns SQLAlchemy engine options for database_path from the DB_POOL_*
+    environment variables. SQLite keeps its own pool class, so sizing only
+    applies to server databases.
+    '''
+    pre_ping = environ.get('DB_POOL_PRE_PING', 'true').lower()
+    options = {
+        'pool_pre_ping': pre_ping in ('1', 'true', 'yes'),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    if not database_path.startswith('sqlite'):
+        options.update({
+            'poolclass': InstrumentedQueuePool,
+            'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 30)),
+        })
+    return options
+
+
+class QuestionPool(object):
+    '''
+    per-category lists of question ids for sampling quiz questions. category
+    '0' holds every question. A category's list is loaded on first use,
+    dropped again whenever a question in it is inserted or deleted, and
+    reloaded once it is older than max_age seconds to pick up other
+    workers' changes.
+    '''
+    # Random draws tried before falling back to a set difference
+    attempts = 8
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._generation = 0
+        # category: (ids, time loaded)
+        self._ids = {}
+
+    def ids(self, category):
+        now = time.time()
+        loaded = self._ids.get(category)
+        if loaded is not None and now - loaded[1] <= self.max_age:
+            return loaded[0]
+        generation = self._generation
+        query = db.session.query(Question.id)
+        if category != '0':
+            query = query.filter(Question.category == category)
+        ids = [question_id for question_id, in query]
+        with self._lock:
+            # Not kept if a question changed while it was loading
+            if generation == self._generation:
+                self._ids[category] = (ids, now)
+        return ids
+
+    def sample(self, category, asked):
+        '''
+        returns a random id from category that is not in the set asked, or
+        None once every question has been asked
+        '''
+        ids = self.ids(category)
+        if len(asked) < len(ids):
+            # While most questions are unasked a few draws find one
+            for _ in range(self.attempts):
+                question_id = random.choice(ids)
+                if question_id not in asked:
+                    return question_id
+        unasked = set(ids).difference(asked)
+        return random.choice(tuple(unasked)) if unasked else None
+
+    def invalidate(self, category=None):
+        with self._lock:
+            self._generation += 1
+            if category is None:
+                self._ids.clear()
+            else:
+                self._ids.pop(str(category), None)
+                self._ids.pop('0', None)
+
+
+question_pool = QuestionPool(
+    int(os.environ.get('QUESTION_POOL_MAX_AGE', 60))
+)
+
+
+def shuffled_position(position, size, seed):
+    '''
+    returns where position lands in a random permutation of range(size)
+    chosen by seed, without materializing the permutation. A four round
+    Feistel network permutes the smallest even-bit domain covering size,
+    and positions outside range(size) are walked until they fall inside.
+    '''
+    half = max((size - 1).bit_length() + 1, 2) // 2
+    mask = (1 << half) - 1
+    while True:
+        left, right = position >> half, position & mask
+        for round in range(4):
+            digest = hashlib.blake2b(
+                b'%d:%d:%d' % (seed, round, right), digest_size=8
+            ).digest()
+            left, right = right, left ^ (int.from_bytes(digest, 'big') & mask)
+        position = (left << half) | right
+        if position < size:
+            return position
+
+
+class QuizSessions(object):
+    '''
+    server side quiz sessions. Each token maps to its category's id list
+    (shared with the question pool, not copied), a random seed and a
+    cursor; the shuffled order is computed one step at a time. Sessions
+    expire after ttl seconds without a call, and beyond max_sessions the
+    least recently used ones are dropped. Sessions live in the worker
+    process that created them.
+    '''
+    def __init__(self, ttl, max_sessions):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # Least recently used first, so expired sessions sit at the front
+        self._sessions = OrderedDict()
+
+    def _expire(self, now):
+        while self._sessions:
+            token, session = next(iter(self._sessions.items()))
+            if session['expires'] > now and (
+                len(self._sessions) < self.max_sessions
+            ):
+                break
+            del self._sessions[token]
+
+    def create(self, category):
+        '''
+        returns a new token and the number of questions in its quiz
+        '''
+        ids = question_pool.ids(category)
+        token = secrets.token_urlsafe(16)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self._sessions[token] = {
+                'ids': ids,
+                'seed': random.getrandbits(64),
+                'cursor': 0,
+                'expires': now + self.ttl,
+            }
+        return token, len(ids)
+
+    def advance(self, token):
+        '''
+        returns the next question id of the session, None once its quiz is
+        over, or raises KeyError for an unknown or expired token
+        '''
+        now = time.time()
+        with self._lock:
+            session = self._sessions[token]
+            if session['expires'] <= now:
+                del self._sessions[token]
+                raise KeyError(token)
+            session['expires'] = now + self.ttl
+            self._sessions.move_to_end(token)
+            ids, cursor = session['ids'], session['cursor']
+            if cursor == len(ids):
+                return None
+            session['cursor'] += 1
+        return ids[shuffled_position(cursor, len(ids), session['seed'])]
+
+    def remaining(self, token):
+        with self._lock:
+            session = self._sessions[token]
+            return len(session['ids']) - session['cursor']
+
+    def end(self, token):
+        with self._lock:
+            return self._sessions.pop(token, None) is not None
+
+
+quiz_sessions = QuizSessions(
+    int(os.environ.get('QUIZ_SESSION_TTL', 3600)),
+    int(os.environ.get('QUIZ_SESSION_MAX', 10000))
+)
+
+
+class CategoryCache(object):
+    '''
+    the {id: type} category map, its serialized /categories body and an etag
+    for it. Category writes bump the version and the next read reloads.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self._loaded = None
+
+    def load(self):
+        '''
+        returns (version, categories, body, etag) from a single load
+        '''
+        version = self.version
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == version:
+            return loaded
+        rows = db.session.query(Category.id, Category.type)
+        categories = {id: type for id, type in rows}
+        body = json.dumps(
+            {'categories': {str(k): v for k, v in categories.items()}},
+            sort_keys=True
+        )
+        # Derived from the content so every worker agrees on it
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        loaded = (version, categories, body, etag)
+        with self._lock:
+            if self.version == version:
+                self._loaded = loaded
+        return loaded
+
+    @property
+    def categories(self):
+        return self.load()[1]
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._loaded = None
+
+
+category_cache = CategoryCache()
+
+
+class QuestionCount(object):
+    '''
+    the number of questions. Inserts and deletes in this worker adjust it,
+    and once it is older than max_age seconds a background thread recounts
+    to pick up other workers' changes while the old value is served.
+    '''
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._value = None
+        self._counted = 0.0
+        self._refreshing = False
+
+    def get(self):
+        if self._value is None:
+            self._count(db.engine)
+            return self._value
+        with self._lock:
+            refresh = (
+                not self._refreshing and
+                time.time() - self._counted > self.max_age
+            )
+            self._refreshing = self._refreshing or refresh
+        if refresh:
+            thread = threading.Thread(target=self._count, args=(db.engine,))
+            thread.daemon = True
+            thread.start()
+        return self._value
+
+    def _count(self, engine):
+        started = time.time()
+        try:
+            query = select([func.count()]).select_from(Question.__table__)
+            with engine.connect() as connection:
+                value = connection.execute(query).scalar()
+            with self._lock:
+                self._value = value
+                self._counted = started
+        finally:
+            self._refreshing = False
+
+    def add(self, n):
+        with self._lock:
+            if self._value is not None:
+                self._value += n
+
+
+question_count = QuestionCount(
+    int(os.environ.get('QUESTION_COUNT_MAX_AGE', 60))
+)
+
+
+SearchResult = namedtuple('SearchResult', ['total', 'questions'])
+
+
+def search_words(term):
+    return re.findall(r'\w+', term.lower())
+
+
+class PostgresQuestionSearch(object):
+    '''
+    full-text search over question and answer text using the GIN index
+    created by migration 7c2e9a4d1f60. Every word of the term must match
+    the start of a word, and question matches rank above answer matches.
+    '''
+    REGCONFIG = literal_column("'simple'::regconfig")
+
+    def document(self):
+        # Must stay identical to the expression indexed by the migration
+        empty = literal_column("''")
+        question = func.setweight(
+            func.to_tsvector(
+                self.REGCONFIG, func.coalesce(Question.question, empty)
+            ),
+            literal_column("'A'")
+        )
+        answer = func.setweight(
+            func.to_tsvector(
+                self.REGCONFIG, func.coalesce(Question.answer, empty)
+            ),
+            literal_column("'B'")
+        )
+        return question.op('||')(answer)
+
+    def search(self, term, page, per_page):
+        words = search_words(term)
+        if not words:
+            query = Question.query.order_by(Question.id)
+            total = question_count.get()
+        else:
+            tsquery = func.to_tsquery(
+                self.REGCONFIG, ' & '.join(w + ':*' for w in words)
+            )
+            document = self.document()
+            query = Question.query.filter(document.op('@@')(tsquery))
+            total = query.count()
+            query = query.order_by(
+                desc(func.ts_rank(document, tsquery)), Question.id
+            )
+        questions = query.offset((page - 1) * per_page).limit(per_page).all()
+        return SearchResult(total, questions)
+
+    def invalidate(self):
+        pass
+
+
+class InMemoryQuestionSearch(object):
+    '''
+    in-process inverted index over question and answer words, used where
+    the database has no full-text search (e.g. SQLite). Matches and ranks
+    like PostgresQuestionSearch. Built on first use and rebuilt after
+    question writes.
+    '''
+    # Rank of a word matched in the answer relative to one in the question
+    ANSWER_WEIGHT = 0.4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+
+    def _build(self):
+        docs = {}
+        postings = {}
+        rows = db.session.query(
+            Question.id, Question.question, Question.answer
+        )
+        for id, question, answer in rows:
+            doc = (search_words(question or ''), search_words(answer or ''))
+            docs[id] = doc
+            for word in doc[0] + doc[1]:
+                postings.setdefault(word, set()).add(id)
+        return docs, postings, sorted(postings)
+
+    def index(self):
+        index = self._index
+        if index is None:
+            index = self._build()
+            with self._lock:
+                self._index = index
+        return index
+
+    def lookup(self, word):
+        '''
+        returns the ids of questions with a word starting with word
+        '''
+        docs, postings, vocabulary = self.index()
+        ids = set()
+        i = bisect.bisect_left(vocabulary, word)
+        while i < len(vocabulary) and vocabulary[i].startswith(word):
+            ids |= postings[vocabulary[i]]
+            i += 1
+        return ids
+
+    def score(self, doc, words):
+        question, answer = doc
+        score = 0.0
+        for word in words:
+            if any(w.startswith(word) for w in question):
+                score += 1.0
+            if any(w.startswith(word) for w in answer):
+                score += self.ANSWER_WEIGHT
+        return score
+
+    def search(self, term, page, per_page):
+        docs, _, _ = self.index()
+        words = search_words(term)
+        if not words:
+            ranked = sorted(docs)
+        else:
+            # Rarest words first keeps the intersection small
+            matches = sorted((self.lookup(w) for w in set(words)), key=len)
+            ids = matches[0]
+            for match in matches[1:]:
+                ids = ids & match
+            ranked = sorted(
+                ids, key=lambda i: (-self.score(docs[i], words), i)
+            )
+        start = (page - 1) * per_page
+        page_ids = ranked[start:start + per_page]
+        questions = {
+            q.id: q for q in Question.query.filter(Question.id.in_(page_ids))
+        } if page_ids else {}
+        return SearchResult(
+            len(ranked), [questions[i] for i in page_ids if i in questions]
+        )
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+
+class QuestionSearch(object):
+    '''
+    picks PostgresQuestionSearch or InMemoryQuestionSearch for the configured
+    database on first use
+    '''
+    def __init__(self):
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if db.engine.dialect.name == 'postgresql':
+                self._backend = PostgresQuestionSearch()
+            else:
+                self._backend = InMemoryQuestionSearch()
+        return self._backend
+
+    def search(self, term, page, per_page):
+        '''
+        returns a page of questions matching term. A blank term matches every
+        question; one with no words to search for, like "???", matches none.
+        '''
+        if term.strip() and not search_words(term):
+            return SearchResult(0, [])
+        return self.backend.search(term, page, per_page)
+
+    def invalidate(self):
+        if self._backend is not None:
+            self._backend.invalidate()
+
+
+question_search = QuestionSearch()
+
+
 def setup_db(app, database_path=database_path):
     '''
     binds a flask application and a SQLAlchemy service
     '''
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
     db.create_all()
+    pool_metrics.instrument(db.get_engine(app))
     migrate = Migrate(app, db)
 
 
@@ -53,13 +604,22 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        question_pool.invalidate(self.category)
+        question_count.add(1)
+        question_search.invalidate()
 
     def update(self):
         db.session.commit()
+        question_pool.invalidate()
+        question_search.invalidate()
 
     def delete(self):
+        category = self.category
         db.session.delete(self)
         db.session.commit()
+        question_pool.invalidate(category)
+        question_count.add(-1)
+        question_search.invalidate()
 
     def format(self):
         return {
@@ -83,6 +643,20 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        category_cache.invalidate()
+
+    def update(self):
+        db.session.commit()
+        category_cache.invalidate()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        category_cache.invalidate()
+
     def format(self):
         return {
             'id': self.id,
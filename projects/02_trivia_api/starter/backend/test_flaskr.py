@@ -41,15 +41,51 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data["categories"], test_data)
 
+    def testGetCategoriesNotModified(self):
+        response = self.client().get("/categories")
+        etag = response.headers["ETag"]
+        response = self.client().get(
+            "/categories", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        category = Category("Test Category")
+        category.insert()
+        # The next request ends the session and detaches category
+        category_id = category.id
+        self.addCleanup(
+            lambda: Category.query.get(category_id).delete()
+        )
+        response = self.client().get(
+            "/categories", headers={"If-None-Match": etag}
+        )
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["categories"][str(category_id)], "Test Category")
+
     def testGetQuestionsPaginated(self):
         response = self.client().get("/questions?page=1")
         data = json.loads(response.data)
 
-        questions = Question.query.paginate(1, 10).items
-        test_data = format_list(questions)
+        questions = Question.query.order_by(Question.id).paginate(1, 10)
+        test_data = format_list(questions.items)
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data["questions"], test_data)
+        self.assertEqual(data["total_questions"], questions.total)
+
+    def testGetQuestionsByCursor(self):
+        response = self.client().get("/questions?page=1")
+        cursor = json.loads(response.data)["next_cursor"]
+        response = self.client().get("/questions?cursor=" + str(cursor))
+        data = json.loads(response.data)
+
+        questions = Question.query.order_by(Question.id).paginate(2, 10)
+        test_data = format_list(questions.items)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["questions"], test_data)
+        self.assertEqual(data["total_questions"], questions.total)
 
     def testDeleteQuestion(self):
         test_id = Question.query.first().id
@@ -97,6 +133,42 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(test_question, question_list)
 
+    def testSearchQuestionsAnswersPaginated(self):
+        question = Question("Who wrote Hamlet?", "Shakespeare", "2", 2)
+        question.insert()
+        question_id = question.id
+        self.addCleanup(lambda: Question.query.get(question_id).delete())
+        payload = json.dumps({
+            "searchTerm": "shakespeare",
+            "page": 1
+        })
+        response = self.client().post(
+            "/questions/search", method="POST",
+            content_type="application/json",
+            data=payload
+        )
+        data = json.loads(response.data)
+        question_list = [q["id"] for q in data["questions"]]
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(question_id, question_list)
+        self.assertLessEqual(len(question_list), 10)
+        self.assertGreaterEqual(data["total_questions"], 1)
+        self.assertLess(data["total_questions"], Question.query.count())
+
+    def testSearchQuestionsWithoutWords(self):
+        payload = json.dumps({
+            "searchTerm": "???"
+        })
+        response = self.client().post(
+            "/questions/search", method="POST",
+            content_type="application/json",
+            data=payload
+        )
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["questions"], [])
+        self.assertEqual(data["total_questions"], 0)
+
     def testGetQuestionsByCategory(self):
         test_question = Question.query.first()
         test_category_id = test_question.category
@@ -137,6 +209,85 @@ class TriviaTestCase(unittest.TestCase):
             self.assertNotIn(next_question["id"], previous_questions)
             previous_questions.append(next_question["id"])
 
+    def testGetNextQuizQuestionAfterInsert(self):
+        test_category = Category.query.first()
+        previous_questions = [q.id for q in Question.query.filter_by(
+            category=str(test_category.id)
+        ).all()]
+        # Warm the category's id pool before adding a question to it
+        self.client().post(
+            "/quizzes",
+            method="POST",
+            content_type="application/json",
+            data=json.dumps({
+                "previous_questions": previous_questions,
+                "quiz_category": {"id": str(test_category.id)}
+            })
+        )
+        question = Question("Pool Question", "Ok", str(test_category.id), 1)
+        question.insert()
+        question_id = question.id
+        self.addCleanup(lambda: Question.query.get(question_id).delete())
+        response = self.client().post(
+            "/quizzes",
+            method="POST",
+            content_type="application/json",
+            data=json.dumps({
+                "previous_questions": previous_questions,
+                "quiz_category": {"id": str(test_category.id)}
+            })
+        )
+        next_question = json.loads(response.data).get("question")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(next_question["id"], question_id)
+
+    def testQuizSession(self):
+        test_category = Category.query.first()
+        test_questions = format_list(Question.query.filter_by(
+            category=str(test_category.id)
+        ).all())
+        response = self.client().post(
+            "/quizzes/sessions",
+            method="POST",
+            content_type="application/json",
+            data=json.dumps({
+                "quiz_category": {"id": str(test_category.id)}
+            })
+        )
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["total_questions"], len(test_questions))
+
+        url = "/quizzes/sessions/" + data["session"]
+        asked = []
+        for q in test_questions:
+            response = self.client().post(url + "/next", method="POST")
+            next_question = json.loads(response.data)["question"]
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(next_question, test_questions)
+            self.assertNotIn(next_question["id"], asked)
+            asked.append(next_question["id"])
+
+        response = self.client().post(url + "/next", method="POST")
+        data = json.loads(response.data)
+        self.assertIsNone(data["question"])
+        self.assertEqual(data["remaining_questions"], 0)
+
+        response = self.client().delete(url, method="DELETE")
+        self.assertEqual(response.status_code, 200)
+        response = self.client().post(url + "/next", method="POST")
+        self.assertEqual(response.status_code, 404)
+
+    def testGetPoolMetrics(self):
+        self.client().get("/categories")
+        response = self.client().get("/_metrics/pool")
+        data = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(data["checkouts"], 0)
+        self.assertIn("wait_seconds_total", data)
+        self.assertIn("connection_age_seconds_max", data)
+
     def testErrorHandler400(self):
         payload = json.dumps({
             "term": "obama"
@@ -11,9 +11,11 @@ class QuestionView extends Component {
     this.state = {
       questions: [],
       page: 1,
+      nextCursor: null,
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      searchTerm: null,
     }
   }
 
@@ -21,16 +23,20 @@ class QuestionView extends Component {
     this.getQuestions();
   }
 
-  getQuestions = () => {
+  getQuestions = (cursor=null) => {
+    // Following a cursor seeks on the id index; page is for direct jumps
+    const query = cursor === null ? `page=${this.state.page}` : `cursor=${cursor}`
     $.ajax({
-      url: `/questions?page=${this.state.page}`, //TODO: update request URL
+      url: `/questions?${query}`, //TODO: update request URL
       type: "GET",
       success: (result) => {
         this.setState({
           questions: result.questions,
+          nextCursor: result.next_cursor,
           totalQuestions: result.total_questions,
           categories: result.categories,
-          currentCategory: result.current_category })
+          currentCategory: result.current_category,
+          searchTerm: null })
         return;
       },
       error: (error) => {
@@ -41,9 +47,22 @@ class QuestionView extends Component {
   }
 
   selectPage(num) {
+    if(this.state.searchTerm !== null) {
+      this.submitSearch(this.state.searchTerm, num)
+      return;
+    }
+    if(num === this.state.page + 1 && this.state.nextCursor !== null) {
+      this.nextPage()
+      return;
+    }
     this.setState({page: num}, () => this.getQuestions());
   }
 
+  nextPage() {
+    const cursor = this.state.nextCursor
+    this.setState({page: this.state.page + 1}, () => this.getQuestions(cursor));
+  }
+
   createPagination(){
     let pageNumbers = [];
     let maxPage = Math.ceil(this.state.totalQuestions / 10)
@@ -55,6 +74,14 @@ class QuestionView extends Component {
           onClick={() => {this.selectPage(i)}}>{i}
         </span>)
     }
+    if(this.state.searchTerm === null && this.state.nextCursor !== null) {
+      pageNumbers.push(
+        <span
+          key="next"
+          className="page-num"
+          onClick={() => {this.nextPage()}}>Next
+        </span>)
+    }
     return pageNumbers;
   }
 
@@ -65,8 +92,10 @@ class QuestionView extends Component {
       success: (result) => {
         this.setState({
           questions: result.questions,
+          nextCursor: null,
           totalQuestions: result.total_questions,
-          currentCategory: result.current_category })
+          currentCategory: result.current_category,
+          searchTerm: null })
         return;
       },
       error: (error) => {
@@ -76,13 +105,13 @@ class QuestionView extends Component {
     })
   }
 
-  submitSearch = (searchTerm) => {
+  submitSearch = (searchTerm, page=1) => {
     $.ajax({
       url: `/questions/search`, //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
-      data: JSON.stringify({searchTerm: searchTerm}),
+      data: JSON.stringify({searchTerm: searchTerm, page: page}),
       xhrFields: {
         withCredentials: true
       },
@@ -90,8 +119,11 @@ class QuestionView extends Component {
       success: (result) => {
         this.setState({
           questions: result.questions,
+          nextCursor: null,
           totalQuestions: result.total_questions,
-          currentCategory: result.current_category })
+          currentCategory: result.current_category,
+          searchTerm: searchTerm,
+          page: page })
         return;
       },
       error: (error) => {
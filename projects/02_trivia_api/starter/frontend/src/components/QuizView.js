@@ -10,6 +10,7 @@ class QuizView extends Component {
     super();
     this.state = {
         quizCategory: null,
+        quizSession: null,
         previousQuestions: [], 
         showAnswer: false,
         categories: {},
@@ -36,7 +37,30 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    $.ajax({
+      url: '/quizzes/sessions', //TODO: update request URL
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        quiz_category: {type, id}
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({
+          quizCategory: {type, id},
+          quizSession: result.session
+        }, this.getNextQuestion)
+        return;
+      },
+      error: (error) => {
+        alert('Unable to start quiz. Please try your request again')
+        return;
+      }
+    })
   }
 
   handleChange = (event) => {
@@ -47,12 +71,16 @@ class QuizView extends Component {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
+    // The server keeps the shuffled questions of the session, so only
+    // its token is sent. Sessions live in one server process; if it is
+    // gone, play on by sending the previous questions instead.
+    const session = this.state.quizSession
     $.ajax({
-      url: '/quizzes', //TODO: update request URL
+      url: session ? `/quizzes/sessions/${session}/next` : '/quizzes', //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
-      data: JSON.stringify({
+      data: session ? undefined : JSON.stringify({
         previous_questions: previousQuestions,
         quiz_category: this.state.quizCategory
       }),
@@ -71,6 +99,10 @@ class QuizView extends Component {
         return;
       },
       error: (error) => {
+        if(session && error.status === 404) {
+          this.setState({quizSession: null}, this.getNextQuestion)
+          return;
+        }
         alert('Unable to load question. Please try your request again')
         return;
       }
@@ -88,8 +120,15 @@ class QuizView extends Component {
   }
 
   restartGame = () => {
+    if(this.state.quizSession) {
+      $.ajax({
+        url: `/quizzes/sessions/${this.state.quizSession}`, //TODO: update request URL
+        type: "DELETE"
+      })
+    }
     this.setState({
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [], 
       showAnswer: false,
       numCorrect: 0,